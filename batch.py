@@ -0,0 +1,274 @@
+# ----------------------------------------------------------------------
+# batch.py
+#
+# Translate a whole corpus of .isa snippets in one process.
+#
+# usage: python batch.py [-o <output_dir>] [-m <manifest>] [-j <jobs>]
+#                        [-c <combined_file>] [--cache <cache_dir>]
+#                        [--ast-cache <cache_dir>] [--comments <mode>]
+#                        [--ssa] [<dir_or_file> ...]
+#
+# Every snippet produces <output_dir>/<name>.output (what "python cparse.py
+# <file>" prints) and <output_dir>/<name>.debug (the error, if any). A
+# summary of the run, with the time each snippet took and the number of
+# basic blocks its code creates, is printed and written to
+# <output_dir>/summary.txt.
+#
+# Every snippet is translated in a fresh translator.TranslationContext, so
+# nothing leaks from one snippet into the next. With -j, snippets are
+# translated by a pool of worker processes (threads would share the GIL).
+# Results are collected in input order, so the output does not depend on
+# the number of jobs.
+#
+# With -c, the generated code of all snippets is streamed into one
+# combined file as it is emitted, instead of being kept in memory. Every
+# snippet starts with a "// <name>" line. The handle declarations a
+# snippet needs are only known at its end, so they go to
+# <combined_file>.prologue under the same "// <name>" line. The .output
+# files then only hold what the translator printed.
+#
+# With --cache, snippets whose text, registered operands and translator
+# source are unchanged are read back from a cache.ContentCache instead of
+# being translated again. With --ast-cache, the parsed trees are kept in
+# a cache.ASTCache, so that only the translation is run again after
+# translator.py changes. --comments picks how the generated code is
+# commented with the source (see translator.CommentMode). --ssa keeps the
+# scalar locals in SSA form instead of allocas.
+# ----------------------------------------------------------------------
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from StringIO import StringIO
+
+import cache as contentCache
+import cparse
+import translator
+
+class Snippet(object):
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+def collectSnippets(paths, manifests=()):
+    snippets = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirPath, dirNames, fileNames in os.walk(path):
+                dirNames.sort()
+                for fileName in sorted(fileNames):
+                    if not fileName.startswith("."):
+                        filePath = os.path.join(dirPath, fileName)
+                        snippets.append(Snippet(filePath, os.path.relpath(filePath, path)))
+        else:
+            snippets.append(Snippet(path, os.path.basename(path)))
+    for manifest in manifests:
+        baseDir = os.path.dirname(manifest)
+        with open(manifest, "r") as fIn:
+            for line in fIn:
+                line = line.strip()
+                if line == "" or line.startswith("#"):
+                    continue
+                snippets.append(Snippet(os.path.join(baseDir, line), line))
+    return snippets
+
+class SnippetResult(object):
+    def __init__(self, name, output, debug, ok, seconds, astHit=None, blocks=None):
+        self.name = name
+        self.output = output
+        self.debug = debug
+        self.ok = ok
+        self.seconds = seconds
+        # whether the tree came from the AST cache (None: not looked up)
+        self.astHit = astHit
+        # number of basic blocks the code creates (None: read from the cache)
+        self.blocks = blocks
+
+# How this process translates, set by configure(): the comment mode, SSA
+# mode and the AST cache. Worker processes are configured with the same
+# arguments.
+commentMode = translator.CommentMode.FULL
+ssa = False
+astCache = None
+configuration = (translator.CommentMode.FULL, False, None, 0)
+
+def configure(comments, useSSA=False, astCacheDirectory=None, astCacheMaxBytes=0):
+    global commentMode, ssa, astCache, configuration
+    commentMode = comments
+    ssa = useSSA
+    astCache = None
+    if astCacheDirectory != None:
+        astCache = contentCache.ASTCache(astCacheDirectory, astCacheMaxBytes)
+    configuration = (comments, useSSA, astCacheDirectory, astCacheMaxBytes)
+
+def translateFile(path, name, sink=None):
+    'translate one snippet file, capturing everything "python cparse.py" would print'
+    start = time.time()
+    with open(path, "r") as fIn:
+        source = fIn.read()
+    stdout = sys.stdout
+    sys.stdout = captured = StringIO()
+    ctx = translator.TranslationContext(sink, commentMode, ssa)
+    if astCache != None:
+        astHits = astCache.stats.hits
+    debug = ""
+    ok = True
+    try:
+        cparse.translateSnippet(ctx, source, astCache)
+    except Exception:
+        ok = False
+        debug = traceback.format_exc()
+    finally:
+        sys.stdout = stdout
+        ctx.emitter.finish()
+    output = captured.getvalue()
+    if sink == None:
+        output += ctx.emitter.getCode() + "\n"
+    astHit = None
+    if astCache != None:
+        astHit = astCache.stats.hits > astHits
+    return SnippetResult(name, output, debug, ok, time.time() - start, astHit, ctx.blockCount)
+
+def translateSnippetFile(snippet):
+    return translateFile(snippet.path, snippet.name)
+
+def lookupCache(cache, snippet):
+    'return the cache key of the snippet and its cached result, or None'
+    start = time.time()
+    with open(snippet.path, "r") as fIn:
+        source = fIn.read()
+    key = cache.key(source, "batch %s %s" % (commentMode, ssa))
+    output = cache.get(key)
+    if output == None:
+        return key, None
+    return key, SnippetResult(snippet.name, output, "", True, time.time() - start)
+
+def streamSnippets(snippets, combined):
+    'translate the snippets one by one, streaming their code into one combined file'
+    with open(combined, "w") as stream:
+        with open(combined + ".prologue", "w") as headerStream:
+            for snippet in snippets:
+                stream.write("// %s\n" % snippet.name)
+                headerStream.write("// %s\n" % snippet.name)
+                yield translateFile(snippet.path, snippet.name,
+                                    translator.StreamSink(stream, headerStream))
+
+def writeResult(outputDir, result):
+    basePath = os.path.join(outputDir, result.name)
+    if not os.path.isdir(os.path.dirname(basePath)):
+        os.makedirs(os.path.dirname(basePath))
+    with open(basePath + ".output", "w") as fOut:
+        fOut.write(result.output)
+    with open(basePath + ".debug", "w") as fOut:
+        fOut.write(result.debug)
+
+def summarize(results, seconds, jobs=1):
+    lines = []
+    for result in results:
+        status = "ok" if result.ok else "FAILED"
+        blocks = "-" if result.blocks == None else str(result.blocks)
+        lines.append("%-8s %8.2f ms %5s blocks  %s" % (status, result.seconds*1000, blocks, result.name))
+    failed = len([result for result in results if not result.ok])
+    blocks = sum(result.blocks for result in results if result.ok and result.blocks != None)
+    lines.append("")
+    lines.append("%d snippets, %d translated, %d failed, %d blocks, %.2f s, %d job(s)" %
+                 (len(results), len(results) - failed, failed, blocks, seconds, jobs))
+    return "\n".join(lines) + "\n"
+
+def runBatch(snippets, outputDir, jobs=1, combined=None, cache=None):
+    start = time.time()
+    results = [None] * len(snippets)
+    keys = {}
+    misses = []
+    for i, snippet in enumerate(snippets):
+        if cache != None:
+            keys[i], result = lookupCache(cache, snippet)
+            if result != None:
+                writeResult(outputDir, result)
+                result.output = None
+                results[i] = result
+                continue
+        misses.append(i)
+    toTranslate = [snippets[i] for i in misses]
+    pool = None
+    if combined != None:
+        translated = streamSnippets(toTranslate, combined)
+    elif jobs > 1:
+        pool = multiprocessing.Pool(jobs, configure, configuration)
+        chunkSize = max(1, len(toTranslate) / (jobs * 4))
+        translated = pool.imap(translateSnippetFile, toTranslate, chunkSize)
+    else:
+        translated = (translateSnippetFile(snippet) for snippet in toTranslate)
+    try:
+        for i, result in itertools.izip(misses, translated):
+            if cache != None and result.ok:
+                cache.put(keys[i], result.output)
+            writeResult(outputDir, result)
+            result.output = None
+            results[i] = result
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+    return results, time.time() - start
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description="Translate .isa snippets in one process.")
+    argParser.add_argument("paths", nargs="*", help="snippet files or directories holding them")
+    argParser.add_argument("-m", "--manifest", action="append", default=[],
+                           help="file listing one snippet path per line")
+    argParser.add_argument("-o", "--output", default="output", help="output directory")
+    argParser.add_argument("-j", "--jobs", type=int, default=1,
+                           help="number of worker processes (0: one per CPU)")
+    argParser.add_argument("-c", "--combined",
+                           help="stream the code of all snippets into this file")
+    argParser.add_argument("--cache", help="directory of the translation cache")
+    argParser.add_argument("--cache-size", type=int, default=64,
+                           help="size limit of the translation cache in MB (default: 64)")
+    argParser.add_argument("--comments", choices=translator.CommentMode.modes,
+                           default=translator.CommentMode.FULL,
+                           help="how to comment the generated code with the source (default: full)")
+    argParser.add_argument("--ssa", action="store_true",
+                           help="keep scalar locals in SSA form instead of allocas")
+    argParser.add_argument("--ast-cache", help="directory of the parsed tree cache")
+    argParser.add_argument("--ast-cache-size", type=int, default=256,
+                           help="size limit of the parsed tree cache in MB (default: 256)")
+    args = argParser.parse_args(argv)
+
+    snippets = collectSnippets(args.paths, args.manifest)
+    if not snippets:
+        argParser.error("no snippets to translate")
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    jobs = args.jobs
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+    if args.combined != None and jobs > 1:
+        argParser.error("-c streams into one file and cannot be used with -j")
+    if args.combined != None and args.cache != None:
+        argParser.error("-c does not keep the code and cannot be used with --cache")
+    cache = None
+    if args.cache != None:
+        cache = contentCache.ContentCache(args.cache, args.cache_size*1024*1024)
+    configure(args.comments, args.ssa, args.ast_cache, args.ast_cache_size*1024*1024)
+    results, seconds = runBatch(snippets, args.output, jobs, args.combined, cache)
+    summary = summarize(results, seconds, jobs)
+    if cache != None:
+        summary += str(cache.stats) + "\n"
+    if astCache != None:
+        summary += "ast cache: %d hits, %d misses\n" % (
+            len([result for result in results if result.astHit == True]),
+            len([result for result in results if result.astHit == False]))
+    with open(os.path.join(args.output, "summary.txt"), "w") as fOut:
+        fOut.write(summary)
+    sys.stdout.write(summary)
+    if all(result.ok for result in results):
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,202 @@
+# ----------------------------------------------------------------------
+# benchmark.py
+#
+# Micro benchmarks for the translator.
+#
+# usage: python benchmark.py <benchmark> [options]
+# ----------------------------------------------------------------------
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def report(title, samples):
+    samples = sorted(samples)
+    print("%-20s min %8.2f ms   median %8.2f ms   max %8.2f ms" %
+          (title, samples[0]*1000, samples[len(samples)/2]*1000, samples[-1]*1000))
+
+def benchStartup(repeat="10"):
+    'time "import cparse" in a fresh interpreter, with an empty and with a populated table cache'
+    repeat = int(repeat)
+    def importOnce(env):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", "import cparse"], cwd=here, env=env,
+                              stderr=open(os.devnull, "w"))
+        return time.time() - start
+    baseline = []
+    for i in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", "pass"])
+        baseline.append(time.time() - start)
+    cold = []
+    warm = []
+    for i in range(repeat):
+        cacheDir = tempfile.mkdtemp(prefix="cparse_tables_")
+        try:
+            env = dict(os.environ, CPARSE_TABLE_DIR=cacheDir)
+            cold.append(importOnce(env))
+            warm.append(importOnce(env))
+        finally:
+            shutil.rmtree(cacheDir)
+    report("interpreter", baseline)
+    report("import (cold)", cold)
+    report("import (warm)", warm)
+
+def benchEmit(repeat="5"):
+    'time CodeEmitter on growing outputs; the time per line should stay flat'
+    import translator
+    repeat = int(repeat)
+    lines = [
+        'Value *t%d = builder->CreateAdd(t1, t2, "t%d");',
+        'BasicBlock *block_%d = BasicBlock::Create(context, "block_%d", func);',
+        '/* uint64_t result_%d = (Rn + Rm_%d) */',
+        ]
+    for size in (1000, 4000, 16000, 64000):
+        samples = []
+        for i in range(repeat):
+            start = time.time()
+            emitter = translator.CodeEmitter()
+            for j in range(size):
+                emitter.appendLine(lines[j % len(lines)] % (j, j))
+            emitter.getCode()
+            samples.append(time.time() - start)
+        report("%d lines" % size, samples)
+        report("  per 1000 lines", [sample * 1000 / size for sample in samples])
+
+def readCorpus(corpus):
+    sources = []
+    for dirPath, dirNames, fileNames in os.walk(corpus):
+        dirNames.sort()
+        for fileName in sorted(fileNames):
+            if not fileName.startswith("."):
+                with open(os.path.join(dirPath, fileName), "r") as fIn:
+                    sources.append(fIn.read())
+    return sources
+
+def benchLexer(repeat="10", corpus=os.path.join(here, "testcase")):
+    'lexer throughput over a corpus, in tokens per second'
+    import cparse
+    import translator
+    repeat = int(repeat)
+    sources = readCorpus(corpus)
+    samples = []
+    for i in range(repeat):
+        lexers = [cparse.newLexer(translator.TranslationContext()) for source in sources]
+        count = 0
+        start = time.time()
+        for lexer, source in zip(lexers, sources):
+            lexer.input(source)
+            for token in iter(lexer.token, None):
+                count += 1
+        samples.append(time.time() - start)
+    report("lex %d files" % len(sources), samples)
+    print("%d tokens, %.0f tokens/s (best run)" % (count, count / min(samples)))
+
+def syntheticSnippet(statements):
+    'a block of the given number of statements, and a call with as many arguments'
+    lines = ["{", "uint64_t x0 = 0;"]
+    for i in range(1, statements):
+        lines.append("uint64_t x%d = x%d + %d;" % (i, i - 1, i))
+    lines.append("x0 = f(%s);" % ", ".join("x%d" % i for i in range(statements)))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def benchParse(repeat="5"):
+    'parse synthetic snippets of growing length; the time per statement should stay flat'
+    import cparse
+    import translator
+    repeat = int(repeat)
+    for statements in (1000, 2000, 4000, 8000, 16000):
+        source = syntheticSnippet(statements)
+        samples = []
+        for i in range(repeat):
+            ctx = translator.TranslationContext()
+            start = time.time()
+            cparse.parse(ctx, source)
+            samples.append(time.time() - start)
+        report("%d statements" % statements, samples)
+        report("  per 1000 statements", [sample * 1000 / statements for sample in samples])
+
+def treeSize(tree):
+    'number of tree objects (translator classes and lists) and the bytes they take'
+    seen = set()
+    pending = [tree]
+    count = 0
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, list):
+            size += sys.getsizeof(obj)
+            pending.extend(obj)
+            continue
+        if type(obj).__module__ != "translator":
+            continue
+        count += 1
+        size += sys.getsizeof(obj)
+        if hasattr(obj, "__dict__"):
+            size += sys.getsizeof(obj.__dict__)
+            pending.extend(obj.__dict__.values())
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get("__slots__", ()):
+                pending.append(getattr(obj, name, None))
+    return count, size
+
+def benchAST(statements="4000"):
+    'memory taken by the tree of a synthetic snippet'
+    import cparse
+    import translator
+    source = syntheticSnippet(int(statements))
+    tree = cparse.parse(translator.TranslationContext(), source)
+    count, size = treeSize(tree)
+    print("%d objects, %d bytes, %.1f bytes per object" % (count, size, float(size) / count))
+
+def nestedSnippet(depth):
+    'if statements nested to the given depth, each with an assignment'
+    lines = ["{", "uint64_t x = 0;"]
+    for i in range(depth):
+        lines.append("if (x != %d) {" % i)
+        lines.append("x = x + %d;" % i)
+    lines.extend(["}"] * depth)
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def benchComments(repeat="5"):
+    'translate nested if statements in every comment mode; only "full" should grow faster than the source'
+    import cparse
+    import translator
+    repeat = int(repeat)
+    for depth in (10, 20, 40, 60):
+        source = nestedSnippet(depth)
+        tree = cparse.parse(translator.TranslationContext(), source)
+        for mode in translator.CommentMode.modes:
+            samples = []
+            for i in range(repeat):
+                ctx = translator.TranslationContext(commentMode=mode)
+                ctx.setSource(source)
+                start = time.time()
+                tree.translate(ctx)
+                samples.append(time.time() - start)
+            report("depth %d, %s" % (depth, mode), samples)
+
+benchmarks = {
+    "startup": benchStartup,
+    "emit": benchEmit,
+    "lexer": benchLexer,
+    "parse": benchParse,
+    "ast": benchAST,
+    "comments": benchComments,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print("Usage: %s <%s>" % (sys.argv[0], "|".join(sorted(benchmarks.keys()))))
+        sys.exit(-1)
+    benchmarks[sys.argv[1]](*sys.argv[2:])
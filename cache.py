@@ -0,0 +1,202 @@
+# ----------------------------------------------------------------------
+# cache.py
+#
+# Content-addressed on-disk cache of translated snippets.
+#
+# A snippet is looked up by the hash of its text, of the operands and
+# bitfields registered with the translator (predefinedValues and
+# predefinedTypeID) and of the translator source itself, so a cached
+# translation is never returned once any of them changes. The cache is
+# bounded in size; the least recently used entries are evicted first.
+#
+# ASTCache keeps the parsed trees instead, keyed on the parser and the
+# layout of the tree nodes alone, so that changes to the translation
+# rules can be tried on a whole corpus without parsing it again.
+# ----------------------------------------------------------------------
+
+import cPickle
+import hashlib
+import inspect
+import os
+
+import clex
+import constfold
+import lookuptable
+import cparse
+import translator
+
+# Bump this when the way entries are stored changes.
+CACHE_VERSION = 2
+
+def _sourceText(module):
+    path = module.__file__
+    if path.endswith((".pyc", ".pyo")):
+        path = path[:-1]
+    with open(path, "rb") as fIn:
+        return fIn.read()
+
+def translatorFingerprint():
+    'hash of the translator source, so that editing it invalidates the cache'
+    h = hashlib.sha1()
+    h.update("%d\n" % CACHE_VERSION)
+    for module in (clex, cparse, constfold, lookuptable, translator):
+        h.update(_sourceText(module))
+    return h.hexdigest()
+
+def parserFingerprint():
+    '''hash of the lexer and parser source, which decide what tree a snippet
+    parses to, and of the layout of the tree nodes'''
+    h = hashlib.sha1()
+    h.update("%d\n" % CACHE_VERSION)
+    for module in (clex, cparse):
+        h.update(_sourceText(module))
+    h.update(nodeLayoutFingerprint())
+    return h.hexdigest()
+
+def nodeLayoutFingerprint():
+    '''hash of the name, the slots and the constructor of every tree node
+    class, which a pickled tree depends on. Their translate() methods do
+    not matter.'''
+    h = hashlib.sha1()
+    classes = [value for value in vars(translator).values()
+               if isinstance(value, type) and issubclass(value, translator.Node)]
+    for cls in sorted(classes, key=lambda cls: cls.__name__):
+        h.update("node %s %s %s\n" % (cls.__name__, [base.__name__ for base in cls.__bases__],
+                                      cls.__dict__.get("__slots__")))
+        constructor = cls.__dict__.get("__init__")
+        if constructor != None:
+            h.update(inspect.getsource(constructor))
+    return h.hexdigest()
+
+def schemaFingerprint():
+    'hash of the operands, bitfields and type names registered with the translator'
+    h = hashlib.sha1()
+    for name, value in sorted(translator.predefinedValues.items()):
+        h.update("value %s %s %s %s\n" % (name, value.__class__.__name__,
+                                          value.type.__class__.__name__, value.type))
+    for name, typeID in sorted(translator.predefinedTypeID.items()):
+        h.update("type %s %s %s\n" % (name, typeID.__class__.__name__, typeID))
+    return h.hexdigest()
+
+class CacheStats(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.evictions = 0
+    def __str__(self):
+        return ("cache: %d hits, %d misses, %d bytes read, %d bytes written, %d evicted" %
+                (self.hits, self.misses, self.bytesRead, self.bytesWritten, self.evictions))
+
+class ContentCache(object):
+    '''Translations stored as <directory>/<key>.cpp.
+
+    Call refreshSchema() after registering more operands or bitfields;
+    translator.Translator does this for its own cache.'''
+    suffix = ".cpp"
+    def __init__(self, directory, maxBytes=64*1024*1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.stats = CacheStats()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.codeFingerprint = self.getCodeFingerprint()
+        self.refreshSchema()
+        self.totalBytes = sum(size for path, size, mtime in self._entries())
+    def getCodeFingerprint(self):
+        return translatorFingerprint()
+    def getSchemaFingerprint(self):
+        return schemaFingerprint()
+    def refreshSchema(self):
+        self.prefix = "%s %s\n" % (self.codeFingerprint, self.getSchemaFingerprint())
+    def key(self, source, variant=""):
+        'variant separates callers that store different text for the same source'
+        h = hashlib.sha1(self.prefix)
+        h.update(variant + "\n")
+        h.update(source)
+        return h.hexdigest()
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+    def _entries(self):
+        entries = []
+        for fileName in os.listdir(self.directory):
+            if not fileName.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, fileName)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fIn:
+                text = fIn.read()
+        except IOError:
+            self.stats.misses += 1
+            return None
+        try:
+            # the modification time orders the entries for eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.stats.hits += 1
+        self.stats.bytesRead += len(text)
+        return text
+    def put(self, key, text):
+        path = self._path(key)
+        tempPath = "%s.tmp%d" % (path, os.getpid())
+        with open(tempPath, "wb") as fOut:
+            fOut.write(text)
+        os.rename(tempPath, path)
+        self.stats.bytesWritten += len(text)
+        self.totalBytes += len(text)
+        if self.totalBytes > self.maxBytes:
+            self.evict()
+    def evict(self):
+        'remove the least recently used entries until the cache fits in maxBytes'
+        entries = self._entries()
+        entries.sort(key=lambda entry: entry[2])
+        self.totalBytes = sum(size for path, size, mtime in entries)
+        for path, size, mtime in entries:
+            if self.totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.totalBytes -= size
+            self.stats.evictions += 1
+
+class ASTCache(ContentCache):
+    '''Parsed trees, pickled, keyed on the snippet.
+
+    Only the lexer, the parser, the TYPEID names and the layout of the
+    node classes decide the tree, so editing how translator.py lowers the
+    nodes keeps the entries valid.'''
+    suffix = ".ast"
+    def getCodeFingerprint(self):
+        return parserFingerprint()
+    def getSchemaFingerprint(self):
+        return hashlib.sha1(" ".join(sorted(translator.predefinedTypeID.keys()))).hexdigest()
+    def load(self, key):
+        data = self.get(key)
+        if data == None:
+            return None
+        try:
+            return cPickle.loads(data)
+        except Exception:
+            # written by an incompatible version of the tree classes
+            self.stats.hits -= 1
+            self.stats.misses += 1
+            return None
+    def store(self, key, tree):
+        try:
+            data = cPickle.dumps(tree, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, RuntimeError):
+            # too deep to pickle; it is simply parsed again next time
+            return
+        self.put(key, data)
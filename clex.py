@@ -4,7 +4,9 @@
 # A lexer for ANSI C.
 # ----------------------------------------------------------------------
 
+import sys
 import ply.lex as lex
+import tablecache
 
 # Reserved words
 reserved = (
@@ -45,6 +47,9 @@ tokens = reserved + (
 
     # Ellipsis (...)
     'ELLIPSIS',
+
+    # Bit selection (x<hi:lo>, x<n:>) and sign extension (sext<N>)
+    'BITSEL', 'SEXT',
     )
 
 # Completely ignored characters
@@ -119,6 +124,23 @@ t_SEMI             = r';'
 t_COLON            = r':'
 t_ELLIPSIS         = r'\.\.\.'
 
+# Bit selection: the value is the pair of index strings (hi, lo); a
+# single-bit selection x<n:> has lo == hi. Both are defined before t_ID,
+# so that they take precedence over "<" and over the identifier "sext".
+def t_BITSEL(t):
+    r'<[ \t]*\w+[ \t]*:[ \t]*\w*[ \t]*>'
+    hi, lo = t.value[1:-1].split(":")
+    hi = hi.strip()
+    lo = lo.strip() or hi
+    t.value = (hi, lo)
+    return t
+
+# Sign extension: sext<N> is the function sext_N
+def t_SEXT(t):
+    r'sext<\d+>'
+    t.value = "sext_" + t.value[5:-1]
+    return t
+
 # Identifiers and reserved words
 
 reserved_map = { }
@@ -128,8 +150,7 @@ for r in reserved:
 def t_ID(t):
     r'[A-Za-z_][\w_]*'
     t.type = reserved_map.get(t.value,"ID")
-    import translator
-    if translator.tempTypeIDTable.has(t.value):
+    if t.value in t.lexer.typeNames:
         t.type = "TYPEID"
     return t
 
@@ -154,7 +175,24 @@ def t_error(t):
     print("Illegal character %s" % repr(t.value[0]))
     t.lexer.skip(1)
     
-# lexer = lex.lex(optimize=1)
-lexer = lex.lex()
+# The names reported as TYPEID. The parser adds the names of the structs
+# and unions it reduces, and opens a scope for every compound statement,
+# so a name defined in a block is an ID again after the block.
+class TypeNameTable(object):
+    def __init__(self, names=()):
+        self.names = set(names)
+        self.scopes = [[]]
+    def add(self, name):
+        if name not in self.names:
+            self.names.add(name)
+            self.scopes[-1].append(name)
+    def push(self):
+        self.scopes.append([])
+    def pop(self):
+        for name in self.scopes.pop():
+            self.names.discard(name)
+
+lexer = tablecache.buildLexer(sys.modules[__name__])
+lexer.typeNames = set()
 if __name__ == "__main__":
     lex.runmain(lexer)
\ No newline at end of file
@@ -0,0 +1,225 @@
+# ----------------------------------------------------------------------
+# constfold.py
+#
+# Constant folding over the syntax tree, run between parsing and
+# translation.
+#
+# Integer expressions whose operands are all literals are evaluated here
+# and replaced by a translator.FoldedConstant, which is emitted as a
+# single immediate. The evaluation follows what the translator would
+# generate for the expression, not ISO C: operands are converted as in
+# TypeCaster.castForArithmetic, casts extend according to the signedness
+# of the target type (as IntType.castTo does), and ">>" is a logical
+# shift. sext<N> of a constant is folded too. Expressions whose result
+# the generated code leaves undefined (division by zero, shifting by the
+# width or more, the most negative value divided by -1) are not folded,
+# nor are literals that do not fit their type.
+# ----------------------------------------------------------------------
+
+import translator
+
+def fold(ctx, tree):
+    'fold the constant expressions of tree in place and return it'
+    if isinstance(tree, translator.Node):
+        foldChildren(ctx, tree)
+    return tree
+
+def foldChildren(ctx, node):
+    for cls in type(node).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            child = getattr(node, name, None)
+            if isinstance(child, list):
+                for i, item in enumerate(child):
+                    child[i] = foldNode(ctx, item)
+            elif isinstance(child, translator.Node):
+                setattr(node, name, foldNode(ctx, child))
+
+def foldNode(ctx, node):
+    if not isinstance(node, translator.Node):
+        return node
+    foldChildren(ctx, node)
+    if not isinstance(node, (translator.BinaryOperandExpression, translator.UnaryOperandExpression,
+                             translator.CastExpression, translator.ConditionalExpression,
+                             translator.FunctionCallExpression)):
+        return node
+    value = evaluate(ctx, node)
+    if value == None:
+        return node
+    valueType, bits = value
+    return translator.FoldedConstant(valueType, bits, node)
+
+def mask(size):
+    return (1 << size) - 1
+
+def toSigned(bits, size):
+    if bits >> (size - 1):
+        return bits - (1 << size)
+    return bits
+
+def castBits(bits, fromType, toType):
+    'the bits of IntType.castTo, which extends as the target type is signed'
+    if toType.size > fromType.size and toType.isSigned:
+        bits = toSigned(bits, fromType.size)
+    return bits & mask(toType.size)
+
+charEscapes = {"n": 10, "t": 9, "r": 13, "0": 0, "a": 7, "b": 8, "f": 12, "v": 11,
+               "\\": 92, "'": 39, "\"": 34, "?": 63}
+
+def constantValue(node):
+    'the value of an integer or character constant as (type, bits), or None'
+    if not isinstance(node, translator.IntConstant):
+        return None
+    if isinstance(node, translator.FoldedConstant):
+        return node.type, node.bits
+    text = node.value
+    if isinstance(node, translator.CharConstant):
+        body = text[1:-1]
+        if len(body) == 1 and body != "\\":
+            number = ord(body)
+        elif len(body) == 2 and body[0] == "\\" and body[1] in charEscapes:
+            number = charEscapes[body[1]]
+        else:
+            return None
+    else:
+        try:
+            number = int(text.rstrip("ul"), 0)
+        except ValueError:
+            return None
+    valueType = node.type
+    limit = valueType.size - 1 if valueType.isSigned else valueType.size
+    if number >> limit:
+        # the immediate is truncated by the generated code; leave it to it
+        return None
+    return valueType, number
+
+def arithmeticType(ctx, type1, type2):
+    'the common type of TypeCaster.castForArithmetic'
+    compareResult = type1.compare(ctx, type2)
+    if compareResult == translator.TypeCompareResult.LT:
+        return type2
+    return type1
+
+def evaluate(ctx, node):
+    'the value of a constant expression as (type, bits), or None'
+    if isinstance(node, translator.BinaryOperandExpression):
+        return evaluateBinary(ctx, node)
+    elif isinstance(node, translator.UnaryOperandExpression):
+        operand = constantValue(node.operand)
+        if operand == None:
+            return None
+        operandType, bits = operand
+        if node.operator == "+":
+            return operand
+        elif node.operator == "-":
+            return operandType, -bits & mask(operandType.size)
+        elif node.operator == "~":
+            return operandType, bits ^ mask(operandType.size)
+        elif node.operator == "!":
+            return translator.IntType(False, 1), int(bits == 0)
+        return None
+    elif isinstance(node, translator.CastExpression):
+        operand = constantValue(node.originalExpression)
+        targetType = node.targetType
+        if isinstance(targetType, translator.TypeIDType):
+            targetType = ctx.typeIDTable.get(targetType.typeID)
+        if operand == None or type(targetType) != translator.IntType:
+            return None
+        return targetType, castBits(operand[1], operand[0], targetType)
+    elif isinstance(node, translator.ConditionalExpression):
+        condition = constantValue(node.condition)
+        trueValue = constantValue(node.truePart)
+        falseValue = constantValue(node.falsePart)
+        if condition == None or trueValue == None or falseValue == None:
+            return None
+        resultType = arithmeticType(ctx, trueValue[0], falseValue[0])
+        if castBits(condition[1], condition[0], translator.IntType(False, 1)):
+            chosen = trueValue
+        else:
+            chosen = falseValue
+        return resultType, castBits(chosen[1], chosen[0], resultType)
+    elif isinstance(node, translator.FunctionCallExpression):
+        width = translator.sextWidth(str(node.function))
+        if width == None or len(node.arguments or []) != 1:
+            return None
+        operand = constantValue(node.arguments[0])
+        if operand == None:
+            return None
+        # the argument is converted to uint64_t as in C, extended as its own
+        # type is signed (see FunctionCallExpression._translateSext)
+        operandType, bits = operand
+        if operandType.isSigned:
+            bits = toSigned(bits, operandType.size)
+        bits &= mask(width)
+        return translator.IntType(True, 64), toSigned(bits, width) & mask(64)
+    return None
+
+def evaluateBinary(ctx, node):
+    operator = node.operator
+    left = constantValue(node.left)
+    if operator in ("&&", "||") and left != None:
+        # the right operand is not evaluated when the left one decides
+        leftTrue = left[1] != 0
+        if operator == "&&" and not leftTrue:
+            return translator.IntType(False, 1), 0
+        if operator == "||" and leftTrue:
+            return translator.IntType(False, 1), 1
+    right = constantValue(node.right)
+    if left == None or right == None:
+        return None
+    leftType, leftBits = left
+    rightType, rightBits = right
+    if operator in ("&&", "||"):
+        return translator.IntType(False, 1), int(rightBits != 0)
+    if operator in ("<<", ">>"):
+        shift = castBits(rightBits, rightType, leftType)
+        if shift >= leftType.size:
+            return None
+        if operator == "<<":
+            return leftType, (leftBits << shift) & mask(leftType.size)
+        return leftType, leftBits >> shift
+    operandType = arithmeticType(ctx, leftType, rightType)
+    size = operandType.size
+    a = castBits(leftBits, leftType, operandType)
+    b = castBits(rightBits, rightType, operandType)
+    if operandType.isSigned:
+        signedA = toSigned(a, size)
+        signedB = toSigned(b, size)
+    else:
+        signedA = a
+        signedB = b
+    if operator == "+":
+        return operandType, (a + b) & mask(size)
+    elif operator == "-":
+        return operandType, (a - b) & mask(size)
+    elif operator == "*":
+        return operandType, (a * b) & mask(size)
+    elif operator in ("/", "%"):
+        if b == 0 or (operandType.isSigned and signedA == -(1 << (size - 1)) and signedB == -1):
+            return None
+        # C division truncates toward zero
+        quotient = abs(signedA) // abs(signedB)
+        if (signedA < 0) != (signedB < 0):
+            quotient = -quotient
+        if operator == "/":
+            return operandType, quotient & mask(size)
+        return operandType, (signedA - quotient * signedB) & mask(size)
+    elif operator == "|":
+        return operandType, a | b
+    elif operator == "&":
+        return operandType, a & b
+    elif operator == "^":
+        return operandType, a ^ b
+    boolType = translator.IntType(False, 1)
+    if operator == "==":
+        return boolType, int(a == b)
+    elif operator == "!=":
+        return boolType, int(a != b)
+    elif operator == "<":
+        return boolType, int(signedA < signedB)
+    elif operator == ">":
+        return boolType, int(signedA > signedB)
+    elif operator == "<=":
+        return boolType, int(signedA <= signedB)
+    elif operator == ">=":
+        return boolType, int(signedA >= signedB)
+    return None
@@ -7,7 +7,9 @@
 import sys
 import exceptions
 import clex
+import copy
 import ply.yacc as yacc
+import tablecache
 import translator
 import struct
 import pdb
@@ -21,6 +23,12 @@ tokens = clex.tokens
 # Set start point
 start = 'compound_statement'
 
+def passThrough(action):
+    '''mark the action of unit productions that only pass their node
+    through (t[0] = t[1]); their node keeps the span it already has'''
+    action.passThrough = True
+    return action
+
 # translation-unit:
 
 def p_translation_unit_1(t):
@@ -98,7 +106,8 @@ def p_declaration_list_1(t):
 
 def p_declaration_list_2(t):
     'declaration_list : declaration_list declaration '
-    t[0] = t[1] + t[2]
+    t[1].append(t[2])
+    t[0] = t[1]
 
 # declaration-specifiers
 def p_declaration_specifiers_1(t):
@@ -117,6 +126,7 @@ def p_declaration_specifiers_4(t):
     'declaration_specifiers : storage_class_specifier'
     raise UnhandledSyntaxError
 
+@passThrough
 def p_declaration_specifiers_5(t):
     'declaration_specifiers : type_specifier'
     t[0] = t[1]
@@ -194,6 +204,7 @@ def p_type_specifier_13(t):
     'type_specifier : DOUBLE'
     t[0] = translator.DoubleType()
 
+@passThrough
 def p_type_specifier_14(t):
     '''type_specifier : struct_or_union_specifier
                       | enum_specifier
@@ -218,7 +229,7 @@ def p_struct_or_union_specifier_1(t):
     t[0] = t[1]
     t[0].name = t[2]
     t[0].definition = t[4]
-    translator.tempTypeIDTable.add(t[2], t[0])
+    t.lexer.context.typeNames.add(t[2])
 
 def p_struct_or_union_specifier_2(t):
     'struct_or_union_specifier : struct_or_union LBRACE struct_declaration_list RBRACE'
@@ -241,13 +252,15 @@ def p_struct_or_union_2(t):
     t[0] = translator.UnionType()
 # struct-declaration-list:
 
+@passThrough
 def p_struct_declaration_list_1(t):
     'struct_declaration_list : struct_declaration'
     t[0] = t[1]
 
 def p_struct_declaration_list_2(t):
     'struct_declaration_list : struct_declaration_list struct_declaration'
-    t[0] = t[1] + t[2]
+    t[1].extend(t[2])
+    t[0] = t[1]
 
 # init-declarator-list:
 
@@ -257,10 +270,12 @@ def p_init_declarator_list_1(t):
 
 def p_init_declarator_list_2(t):
     'init_declarator_list : init_declarator_list COMMA init_declarator'
-    t[0] = t[1] + [ t[3] ]
+    t[1].append(t[3])
+    t[0] = t[1]
 
 # init-declarator
 
+@passThrough
 def p_init_declarator_1(t):
     'init_declarator : declarator'
     t[0] = t[1]
@@ -298,6 +313,7 @@ def p_specifier_qualifier_list_1(t):
     'specifier_qualifier_list : type_specifier specifier_qualifier_list'
     raise UnhandledSyntaxError
 
+@passThrough
 def p_specifier_qualifier_list_2(t):
     'specifier_qualifier_list : type_specifier'
     t[0] = t[1]
@@ -318,10 +334,12 @@ def p_struct_declarator_list_1(t):
 
 def p_struct_declarator_list_2(t):
     'struct_declarator_list : struct_declarator_list COMMA struct_declarator'
-    t[0] = t[1] + [ t[3] ]
+    t[1].append(t[3])
+    t[0] = t[1]
 
 # struct-declarator:
 
+@passThrough
 def p_struct_declarator_1(t):
     'struct_declarator : declarator'
     t[0] = t[1]
@@ -377,6 +395,7 @@ def p_declarator_1(t):
     else:
         raise UnhandledSyntaxError
 
+@passThrough
 def p_declarator_2(t):
     'declarator : direct_declarator'
     t[0] = t[1]
@@ -477,6 +496,7 @@ def p_identifier_list_2(t):
 
 # initializer:
 
+@passThrough
 def p_initializer_1(t):
     'initializer : assignment_expression'
     t[0] = t[1]
@@ -494,7 +514,8 @@ def p_initializer_list_1(t):
 
 def p_initializer_list_2(t):
     'initializer_list : initializer_list COMMA initializer'
-    t[0] = t[1] + [ t[3] ]
+    t[1].append(t[3])
+    t[0] = t[1]
 
 # type-name:
 
@@ -512,16 +533,19 @@ def p_type_name(t):
     else:
         raise UnhandledSyntaxError
 
+@passThrough
 def p_abstract_declarator_opt_1(t):
     'abstract_declarator_opt : empty'
     t[0] = t[1]
 
+@passThrough
 def p_abstract_declarator_opt_2(t):
     'abstract_declarator_opt : abstract_declarator'
     t[0] = t[1]
 
 # abstract-declarator:
 
+@passThrough
 def p_abstract_declarator_1(t):
     'abstract_declarator : pointer '
     t[0] = t[1]
@@ -558,6 +582,7 @@ def p_direct_abstract_declarator_5(t):
 
 # Optional fields in abstract declarators
 
+@passThrough
 def p_constant_expression_opt_1(t):
     'constant_expression_opt : empty'
     t[0] = t[1]
@@ -566,6 +591,7 @@ def p_constant_expression_opt_2(t):
     'constant_expression_opt : constant_expression'
     raise UnhandledSyntaxError
 
+@passThrough
 def p_parameter_type_list_opt_1(t):
     'parameter_type_list_opt : empty'
     t[0] = t[1]
@@ -576,6 +602,7 @@ def p_parameter_type_list_opt_2(t):
 
 # statement:
 
+@passThrough
 def p_statement(t):
     '''
     statement : labeled_statement
@@ -609,21 +636,28 @@ def p_expression_statement(t):
 # compound-statement:
 
 def p_compound_statement_1(t):
-    'compound_statement : LBRACE block_item_list RBRACE'
-    t[0] = translator.CompoundStatement(t[2])
+    'compound_statement : LBRACE open_scope block_item_list RBRACE'
+    t[0] = translator.CompoundStatement(t[3])
+    t.lexer.context.typeNames.pop()
 
 def p_compound_statement_2(t):
     'compound_statement : LBRACE RBRACE'
     t[0] = translator.CompoundStatement()
 
+def p_open_scope(t):
+    'open_scope : '
+    t.lexer.context.typeNames.push()
+
 def p_block_item_list_1(t):
     'block_item_list : block_item'
     t[0] = [ t[1] ]
 
 def p_block_item_list_2(t):
     'block_item_list : block_item_list block_item'
-    t[0] = t[1] + [ t[2] ]
+    t[1].append(t[2])
+    t[0] = t[1]
 
+@passThrough
 def p_block_item(t):
     '''block_item : statement
                   | declaration'''
@@ -637,7 +671,8 @@ def p_statement_list_1(t):
 
 def p_statement_list_2(t):
     'statement_list : statement_list statement'
-    t[0] = t[1] + [ t[2] ]
+    t[1].append(t[2])
+    t[0] = t[1]
 
 # selection-statement
 
@@ -689,15 +724,18 @@ def p_jump_statement_4(t):
     'jump_statement : RETURN expression_opt SEMI'
     raise UnhandledSyntaxError
 
+@passThrough
 def p_expression_opt_1(t):
     'expression_opt : empty'
     t[0] = t[1]
 
+@passThrough
 def p_expression_opt_2(t):
     'expression_opt : expression'
     t[0] = t[1]
 
 # expression:
+@passThrough
 def p_expression_1(t):
     'expression : assignment_expression'
     t[0] = t[1]
@@ -705,11 +743,13 @@ def p_expression_1(t):
 def p_expression_2(t):
     'expression : expression COMMA assignment_expression'
     if isinstance(t[1], translator.CommaExpression):
-        t[0] = t[1].append(t[3])
+        t[1].append(t[3])
+        t[0] = t[1]
     else:
         t[0] = translator.CommaExpression([t[1], t[3]])
 
 # assigment_expression:
+@passThrough
 def p_assignment_expression_1(t):
     'assignment_expression : conditional_expression'
     t[0] = t[1]
@@ -719,6 +759,7 @@ def p_assignment_expression_2(t):
     t[0] = translator.BinaryOperandExpression(t[1], t[2], t[3])
 
 # assignment_operator:
+@passThrough
 def p_assignment_operator(t):
     '''
     assignment_operator : EQUALS
@@ -736,6 +777,7 @@ def p_assignment_operator(t):
     t[0] = t[1]
 
 # conditional-expression
+@passThrough
 def p_conditional_expression_1(t):
     'conditional_expression : logical_or_expression'
     t[0] = t[1]
@@ -746,12 +788,14 @@ def p_conditional_expression_2(t):
 
 # constant-expression
 
+@passThrough
 def p_constant_expression(t):
     'constant_expression : conditional_expression'
     t[0] = t[1]
 
 # logical-or-expression
 
+@passThrough
 def p_logical_or_expression_1(t):
     'logical_or_expression : logical_and_expression'
     t[0] = t[1]
@@ -762,6 +806,7 @@ def p_logical_or_expression_2(t):
 
 # logical-and-expression
 
+@passThrough
 def p_logical_and_expression_1(t):
     'logical_and_expression : inclusive_or_expression'
     t[0] = t[1]
@@ -772,6 +817,7 @@ def p_logical_and_expression_2(t):
 
 # inclusive-or-expression:
 
+@passThrough
 def p_inclusive_or_expression_1(t):
     'inclusive_or_expression : exclusive_or_expression'
     t[0] = t[1]
@@ -782,6 +828,7 @@ def p_inclusive_or_expression_2(t):
 
 # exclusive-or-expression:
 
+@passThrough
 def p_exclusive_or_expression_1(t):
     'exclusive_or_expression :  and_expression'
     t[0] = t[1]
@@ -792,6 +839,7 @@ def p_exclusive_or_expression_2(t):
 
 # AND-expression
 
+@passThrough
 def p_and_expression_1(t):
     'and_expression : equality_expression'
     t[0] = t[1]
@@ -802,6 +850,7 @@ def p_and_expression_2(t):
 
 
 # equality-expression:
+@passThrough
 def p_equality_expression_1(t):
     'equality_expression : relational_expression'
     t[0] = t[1]
@@ -816,6 +865,7 @@ def p_equality_expression_3(t):
 
 
 # relational-expression:
+@passThrough
 def p_relational_expression_1(t):
     'relational_expression : shift_expression'
     t[0] = t[1]
@@ -838,6 +888,7 @@ def p_relational_expression_5(t):
 
 # shift-expression
 
+@passThrough
 def p_shift_expression_1(t):
     'shift_expression : additive_expression'
     t[0] = t[1]
@@ -852,6 +903,7 @@ def p_shift_expression_3(t):
 
 # additive-expression
 
+@passThrough
 def p_additive_expression_1(t):
     'additive_expression : multiplicative_expression'
     t[0] = t[1]
@@ -866,6 +918,7 @@ def p_additive_expression_3(t):
 
 # multiplicative-expression
 
+@passThrough
 def p_multiplicative_expression_1(t):
     'multiplicative_expression : cast_expression'
     t[0] = t[1]
@@ -884,6 +937,7 @@ def p_multiplicative_expression_4(t):
 
 # cast-expression:
 
+@passThrough
 def p_cast_expression_1(t):
     'cast_expression : unary_expression'
     t[0] = t[1]
@@ -903,6 +957,7 @@ def p_cast_expression_3(t):
         raise UnhandledSyntaxError
 
 # unary-expression:
+@passThrough
 def p_unary_expression_1(t):
     'unary_expression : postfix_expression'
     t[0] = t[1]
@@ -928,6 +983,7 @@ def p_unary_expression_6(t):
     raise UnhandledSyntaxError
     
 #unary-operator
+@passThrough
 def p_unary_operator(t):
     '''unary_operator : AND
                     | TIMES
@@ -938,6 +994,7 @@ def p_unary_operator(t):
     t[0] = t[1]
 
 # postfix-expression:
+@passThrough
 def p_postfix_expression_1(t):
     'postfix_expression : primary_expression'
     t[0] = t[1]
@@ -957,11 +1014,13 @@ def p_postfix_expression_4(t):
 def p_postfix_expression_5(t):
     'postfix_expression : postfix_expression PERIOD ID'
     member = translator.Variable(t[3])
+    setSpan(member, t, 3)
     t[0] = translator.InstanceFieldAccessExpression(t[1], member)
 
 def p_postfix_expression_6(t):
     'postfix_expression : postfix_expression ARROW ID'
     member = translator.Variable(t[3])
+    setSpan(member, t, 3)
     t[0] = translator.PointerFieldAccessExpression(t[1], member)
 
 def p_postfix_expression_7(t):
@@ -972,11 +1031,27 @@ def p_postfix_expression_8(t):
     'postfix_expression : postfix_expression MINUSMINUS'
     t[0] = translator.UnaryOperandExpression(t[1], t[2], isPrefix=False)
 
+def p_postfix_expression_9(t):
+    'postfix_expression : postfix_expression BITSEL'
+    hi, lo = t[2]
+    function = translator.Variable("bits")
+    args = [t[1], bitIndex(hi), bitIndex(lo)]
+    for node in [function] + args[1:]:
+        setSpan(node, t, 2)
+    t[0] = translator.FunctionCallExpression(function, args)
+
+def bitIndex(index):
+    'an index of x<hi:lo> is either a name or an integer literal'
+    if index[0].isalpha() or index[0] == "_":
+        return translator.Variable(index)
+    return translator.IntConstant(index)
+
 # primary-expression:
 def p_primary_expression_1(t):
     'primary_expression :  ID'
     t[0] = translator.Variable(t[1])
 
+@passThrough
 def p_primary_expression_2(t):
     'primary_expression :  constant'
     t[0] = t[1]
@@ -986,6 +1061,10 @@ def p_primary_expression_3(t):
     'primary_expression : LPAREN expression RPAREN'
     t[0] = t[2]
 
+def p_primary_expression_4(t):
+    'primary_expression :  SEXT'
+    t[0] = translator.Variable(t[1])
+
 # argument-expression-list:
 def p_argument_expression_list_1(t):
     'argument_expression_list :  assignment_expression'
@@ -993,7 +1072,8 @@ def p_argument_expression_list_1(t):
 
 def p_argument_expression_list_2(t):
     'argument_expression_list :  argument_expression_list COMMA assignment_expression'
-    t[0] = t[1] + [ t[3] ]
+    t[1].append(t[3])
+    t[0] = t[1]
 
 # constant:
 def p_constant_1(t): 
@@ -1020,13 +1100,85 @@ def p_error(t):
     print("Whoa. We're hosed")
     raise ParseError
 
-import profile
 # Build the grammar
 
-parser = yacc.yacc(method='LALR')
-# parser = yacc.yacc()
-
-#profile.run("yacc.yacc(method='LALR')")
+parser = tablecache.buildParser(sys.modules[__name__])
+
+# Source spans. The parser runs with position tracking, and every token
+# records where it ends (see parse), so every symbol covers its whole
+# text. Actions are wrapped to give the node they return the span of
+# their production. Unit productions that only pass their node through
+# (marked with passThrough) are left alone; they are most of the
+# reductions.
+def setSpan(node, t, n):
+    node.start, node.end = t.lexspan(n)
+    node.line = t.lineno(n)
+
+def withSpan(action, length):
+    # t.slice is used rather than t[n], which is much slower
+    def spanAction(t):
+        action(t)
+        symbol = t.slice[0]
+        node = symbol.value
+        if isinstance(node, translator.Node):
+            node.start = symbol.lexpos
+            node.end = symbol.endlexpos
+            node.line = symbol.lineno
+    def unitSpanAction(t):
+        action(t)
+        symbol, child = t.slice
+        node = symbol.value
+        if node is not child.value and isinstance(node, translator.Node):
+            node.start = symbol.lexpos
+            node.end = symbol.endlexpos
+            node.line = symbol.lineno
+    if length == 1:
+        return unitSpanAction
+    return spanAction
+
+for production in parser.productions:
+    if production.callable != None:
+        if production.len == 1 and getattr(production.callable, "passThrough", False):
+            continue
+        production.callable = withSpan(production.callable, production.len)
+
+def newLexer(ctx):
+    lexer = clex.lexer.clone()
+    lexer.context = ctx
+    lexer.typeNames = ctx.typeNames.names
+    lexer.lineno = 1
+    return lexer
+
+def parse(ctx, source, debug=0, astCache=None):
+    '''Parse one snippet. The lexer and the parser are copied so that every
+    parse has its own lexing position and TYPEID names (ctx.typeNames).
+    With an astCache (cache.ASTCache), trees parsed before are reused.'''
+    ctx.setSource(source)
+    if astCache != None:
+        key = astCache.key(source)
+        result = astCache.load(key)
+        if result != None:
+            return result
+    lexer = newLexer(ctx)
+    def nextToken():
+        token = lexer.token()
+        if token != None:
+            token.endlexpos = lexer.lexpos
+        return token
+    result = copy.copy(parser).parse(source, debug=debug, lexer=lexer,
+                                     tracking=True, tokenfunc=nextToken)
+    if astCache != None and result != None:
+        astCache.store(key, result)
+    return result
+
+def translateSnippet(ctx, source, astCache=None):
+    '''Translate one snippet. The output, which echoes the source before the
+    generated code, goes to ctx.emitter even if translation fails.'''
+    ctx.emitter.append(source)
+    ctx.emitter.appendLine("")
+    ctx.emitter.appendLine("**********************************")
+    result = parse(ctx, source, astCache=astCache)
+    ctx.translate(result)
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -1034,15 +1186,10 @@ if __name__ == "__main__":
         sys.exit(-1)
     with open(sys.argv[1], "r") as fIn:
         data = fIn.read()
-        translator.CodeEmitter.init()
-        translator.CodeEmitter.append(data)
-        translator.CodeEmitter.appendLine("")
-        translator.CodeEmitter.appendLine("**********************************")
-        data = translator.preprocess(data)
+        ctx = translator.TranslationContext()
         try:
-            result = parser.parse(data, debug=0)
-            result.translate()
+            translateSnippet(ctx, data)
         except:
             raise
         finally:
-            print translator.CodeEmitter.getCode()
+            print ctx.emitter.getCode()
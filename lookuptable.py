@@ -0,0 +1,158 @@
+# ----------------------------------------------------------------------
+# lookuptable.py
+#
+# Finds the switch statements that only pick constants, run before they
+# are translated.
+#
+# In such a switch every case either assigns a constant to the same
+# variable, or calls the same function (one of translator.functions)
+# with constant arguments, and then breaks. Instead of a SwitchInst,
+# translator.SwitchStatement lowers it to constant tables indexed by the
+# control value (see translator.LookupTableExpression): one load per
+# operand, and one assignment or call, without any control flow.
+# ----------------------------------------------------------------------
+
+import constfold
+import translator
+
+# tables longer than this are left to the SwitchInst
+maxEntries = 256
+
+class SwitchTable(object):
+    '''what a value-only switch does. kind is "assign" (target is the name
+    of the variable) or "call" (target is the name of the function). Each
+    group is the labels of one case body and the constants of its
+    action, as (type, bits) per operand.'''
+    def __init__(self, kind, target, groups, default):
+        self.kind = kind
+        self.target = target
+        self.groups = groups
+        # the constants of the default action, or None
+        self.default = default
+
+def flatten(statements, events):
+    'append the labels, actions and breaks of statements to events; False if anything else is found'
+    for statement in statements:
+        while True:
+            if isinstance(statement, translator.CaseStatement):
+                events.append(("label", statement.case))
+                statement = statement.caseBody
+            elif isinstance(statement, translator.DefaultStatement):
+                events.append(("label", None))
+                statement = statement.body
+            else:
+                break
+        if statement == None:
+            continue
+        if isinstance(statement, translator.CompoundStatement):
+            if not flatten(statement.statements or [], events):
+                return False
+        elif isinstance(statement, translator.BreakStatement):
+            events.append(("break", None))
+        elif isinstance(statement, translator.ExpressionStatement):
+            events.append(("action", statement.expression))
+        else:
+            return False
+    return True
+
+def actionOf(expression):
+    'the kind, target and constants of an action, or None'
+    if isinstance(expression, translator.BinaryOperandExpression):
+        if expression.operator != "=" or type(expression.left) != translator.Variable:
+            return None
+        value = constfold.constantValue(expression.right)
+        if value == None:
+            return None
+        return "assign", expression.left.name, [value]
+    elif isinstance(expression, translator.FunctionCallExpression):
+        name = str(expression.function)
+        if name not in translator.functions:
+            return None
+        values = [constfold.constantValue(argument) for argument in expression.arguments or []]
+        if None in values:
+            return None
+        return "call", name, values
+    return None
+
+def findTable(switch):
+    'the SwitchTable of a switch statement, or None if it does more than pick constants'
+    events = []
+    if not isinstance(switch.bodyPart, translator.CompoundStatement) or \
+            not flatten(switch.bodyPart.statements or [], events):
+        return None
+    kind = target = None
+    groups = []
+    default = None
+    labels = []
+    constants = None
+    # a trailing break closes the last case body like the end of the switch
+    for event, value in events + [("break", None)]:
+        if event == "label":
+            if constants != None:
+                # falls through into the next case
+                return None
+            labels.append(value)
+        elif event == "action":
+            if not labels or constants != None:
+                return None
+            action = actionOf(value)
+            if action == None:
+                return None
+            if kind == None:
+                kind, target = action[0], action[1]
+            elif (kind, target) != action[:2] or len(action[2]) != len(groups[0][1]):
+                return None
+            constants = action[2]
+        elif labels or constants != None:
+            if constants == None:
+                return None
+            if None in labels:
+                default = constants
+            groups.append(([label for label in labels if label != None], constants))
+            labels = []
+            constants = None
+    if not [group for group in groups if group[0]]:
+        return None
+    return SwitchTable(kind, target, groups, default)
+
+def controlLimit(control, controlType):
+    'the largest value control can take, as an unsigned number of controlType'
+    if isinstance(control, translator.BinaryOperandExpression) and control.operator == "&":
+        for operand in (control.left, control.right):
+            value = constfold.constantValue(operand)
+            if value != None and not value[1] >> (value[0].size - 1):
+                # a mask that is not negative also clears the sign bit
+                return value[1]
+    return constfold.mask(controlType.size)
+
+def layout(table, controlType, limit):
+    '''lay the table out for an integer control value, no larger than limit:
+    (first, count, rows, covering), where rows[i] holds the constants for
+    the control value first + i, and covering tells whether the labels
+    cover every value the control can take. Otherwise rows has one more
+    row for the values out of range, if there is a default. None if the
+    labels are not constants or too sparse.'''
+    labels = {}
+    for caseLabels, constants in table.groups:
+        for label in caseLabels:
+            value = constfold.constantValue(label)
+            if value == None:
+                return None
+            bits = constfold.castBits(value[1], value[0], controlType)
+            if controlType.isSigned:
+                bits = constfold.toSigned(bits, controlType.size)
+            if bits in labels:
+                return None
+            labels[bits] = constants
+    first = min(labels)
+    count = max(labels) - first + 1
+    if count > maxEntries or count > 4 * len(labels):
+        return None
+    if table.default == None and count != len(labels):
+        # the gaps would have to keep the old value
+        return None
+    rows = [labels.get(first + i, table.default) for i in range(count)]
+    covering = count == 1 << controlType.size or (first == 0 and count == limit + 1)
+    if table.default != None and not covering:
+        rows.append(table.default)
+    return first & constfold.mask(controlType.size), count, rows, covering
@@ -0,0 +1,86 @@
+# ----------------------------------------------------------------------
+# tablecache.py
+#
+# Persistent cache of the PLY lexer and LALR parser tables.
+#
+# The tables are written to a cache directory (CPARSE_TABLE_DIR, or the
+# "tables" directory next to this file) under a name derived from a hash
+# of the grammar. A table whose name matches the current grammar is
+# loaded in PLY's optimized mode, which skips grammar validation.
+# ----------------------------------------------------------------------
+
+import hashlib
+import imp
+import os
+import types
+
+import ply
+import ply.lex as lex
+import ply.yacc as yacc
+
+# Bump this when the way tables are built changes.
+TABLE_VERSION = 1
+
+def getCacheDir():
+    cacheDir = os.environ.get("CPARSE_TABLE_DIR")
+    if not cacheDir:
+        cacheDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables")
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    return cacheDir
+
+def _ruleText(value):
+    if isinstance(value, (types.FunctionType, types.MethodType)):
+        return value.__doc__ or ""
+    return repr(value)
+
+def grammarHash(module, prefix):
+    'hash every rule whose name starts with prefix, plus the token list'
+    h = hashlib.sha1()
+    h.update("%d %s\n" % (TABLE_VERSION, ply.__version__))
+    for name in ("tokens", "start", "precedence", "literals", "states"):
+        if hasattr(module, name):
+            h.update("%s=%r\n" % (name, getattr(module, name)))
+    for name in sorted(dir(module)):
+        if name.startswith(prefix):
+            h.update("%s:%s\n" % (name, _ruleText(getattr(module, name))))
+    return h.hexdigest()[:16]
+
+def _install(cacheDir, tempFile, tabFile, prefix, keep):
+    # Tables are generated under a temporary name and renamed into place,
+    # so that concurrent processes never read a half-written table.
+    os.rename(tempFile, tabFile)
+    for fileName in os.listdir(cacheDir):
+        if fileName.startswith(prefix) and not fileName.startswith(keep):
+            try:
+                os.remove(os.path.join(cacheDir, fileName))
+            except OSError:
+                pass
+
+def buildLexer(module):
+    cacheDir = getCacheDir()
+    tabName = "lextab_%s" % grammarHash(module, "t_")
+    tabFile = os.path.join(cacheDir, tabName + ".py")
+    if os.path.exists(tabFile):
+        try:
+            tabModule = imp.load_source(tabName, tabFile)
+            return lex.lex(module=module, optimize=1, lextab=tabModule)
+        except Exception:
+            pass
+    tempName = "%s_tmp%d" % (tabName, os.getpid())
+    lexer = lex.lex(module=module, optimize=1, lextab=tempName, outputdir=cacheDir)
+    _install(cacheDir, os.path.join(cacheDir, tempName + ".py"), tabFile, "lextab_", tabName)
+    return lexer
+
+def buildParser(module):
+    cacheDir = getCacheDir()
+    tabName = "parsetab_%s" % grammarHash(module, "p_")
+    tabFile = os.path.join(cacheDir, tabName + ".pickle")
+    if os.path.exists(tabFile):
+        return yacc.yacc(method='LALR', module=module, optimize=1, debug=0,
+                         picklefile=tabFile, outputdir=cacheDir)
+    tempFile = "%s.tmp%d" % (tabFile, os.getpid())
+    parser = yacc.yacc(method='LALR', module=module, optimize=1, debug=0,
+                       picklefile=tempFile, outputdir=cacheDir)
+    _install(cacheDir, tempFile, tabFile, "parsetab_", tabName)
+    return parser
@@ -1,23 +1,12 @@
 #!/bin/bash
-function testDir(){
-    for file in $1/*
-    do
-        if [ -f $file ]
-        then
-            echo "+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++"
-            echo "Parsing $file ..."
-            echo "python cparse.py $file"
-            python cparse.py $file 2>output/`basename ${file}`.debug 1>output/`basename ${file}`.output
-            if [ $? -ne 0 ]
-            then
-                exit $?
-            fi
-        elif [ -d $file ]
-        then
-            testDir $file
-        fi
-    done
-}
-
-testDir testcase
+status=0
+mkdir -p output
+python batch.py -j 0 -o output testcase || status=1
+# the same snippets again, with scalar locals in SSA form
+mkdir -p output_ssa
+python batch.py -j 0 --ssa -o output_ssa testcase || status=1
+if [ $status -ne 0 ]
+then
+    exit 1
+fi
 echo "All test finished"
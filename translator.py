@@ -1,114 +1,177 @@
 import exceptions
+import hashlib
 import re
 import struct
 import cparse
 import clex
+import constfold
+import lookuptable
 import pdb
 
-#####################################################################
-#
-#                      Bitfield Operator Support
-#
-#####################################################################
-
-bitOp1ArgRE = re.compile(r'<\s*(\w+)\s*:\s*>')
-
-bitOpWordRE = re.compile(r'(?<![\w\.])([\w\.]+)<\s*(\w+)\s*:\s*(\w+)\s*>')
-bitOpExprRE = re.compile(r'\)<\s*(\w+)\s*:\s*(\w+)\s*>')
-
-def substBitOps(code):
-    # first convert single-bit selectors to two-index form
-    # i.e., <n> --> <n:n>
-    code = bitOp1ArgRE.sub(r'<\1:\1>', code)
-    # simple case: selector applied to ID (name)
-    # i.e., foo<a:b> --> bits(foo, a, b)
-    code = bitOpWordRE.sub(r'bits(\1, \2, \3)', code)
-    # if selector is applied to expression (ending in ')'),
-    # we need to search backward for matching '('
-    match = bitOpExprRE.search(code)
-    while match:
-        exprEnd = match.start()
-        here = exprEnd - 1
-        nestLevel = 1
-        while nestLevel > 0:
-            if code[here] == '(':
-                nestLevel -= 1
-            elif code[here] == ')':
-                nestLevel += 1
-            here -= 1
-            if here < 0:
-                sys.exit("Didn't find '('!")
-        exprStart = here+1
-        newExpr = r'bits(%s, %s, %s)' % (code[exprStart:exprEnd+1],
-                                         match.group(1), match.group(2))
-        code = code[:exprStart] + newExpr + code[match.end():]
-        match = bitOpExprRE.search(code)
-    return code
-
-sextRE = re.compile(r'(?<!\w)sext\<(\d+)\>')
-def substSext(code):
-    code = sextRE.sub(r'sext_\1', code)
-    return code
-
-def preprocess(code):
-    return substBitOps(substSext(code))
-
 class UnhandledTranslationError(Exception): pass
 
+# Sinks receive the generated code from a CodeEmitter. The body is
+# written as it is emitted; the prologue (the declarations of the handles
+# the body uses) is only known at the end and is handed to finish().
+class EmitterSink(object):
+    def write(self, code):
+        raise NotImplementedError
+    def finish(self, prologue):
+        pass
+    def getCode(self, prologue):
+        raise NotImplementedError("%s does not keep the code" % type(self).__name__)
+
+class StringSink(EmitterSink):
+    'keep the code in memory, for getCode()'
+    def __init__(self):
+        self.fragments = []
+    def write(self, code):
+        self.fragments.append(code)
+    def getCode(self, prologue):
+        body = "".join(self.fragments)
+        self.fragments = [body]
+        return prologue + body
+
+class StreamSink(EmitterSink):
+    'write the body to a file object as it is emitted, and the prologue to headerStream'
+    def __init__(self, stream, headerStream):
+        self.stream = stream
+        self.headerStream = headerStream
+    def write(self, code):
+        self.stream.write(code)
+    def finish(self, prologue):
+        self.headerStream.write(prologue)
+        self.headerStream.flush()
+        self.stream.flush()
+
+class CallbackSink(EmitterSink):
+    'call callback("body", code) for every fragment and callback("header", prologue) at the end'
+    def __init__(self, callback):
+        self.callback = callback
+    def write(self, code):
+        self.callback("body", code)
+    def finish(self, prologue):
+        self.callback("header", prologue)
+
 class CodeEmitter(object):
-    @classmethod
-    def init(cls):
-        cls.code = ""
-        cls.regexBuilder = re.compile("(?<!\w)builder(?!\w)")
-        cls.regexContext = re.compile("(?<!\w)context(?!\w)")
-        cls.regexModule = re.compile("(?<!\w)module(?!\w)")
-        cls.regexExecutionEngine = re.compile("(?<!\w)execution_engine(?!\w)")
-        cls.hasBuilder = False
-        cls.hasContext = False
-        cls.hasModule = False
-        cls.hasExecutionEngine = False
-        Temp.reset()
-    @classmethod
-    def appendHelper(cls, code):
-        'if the code uses "builder", "context" or "module", add code to read them'
-        if cls.hasBuilder==False and cls.regexBuilder.search(code) != None:
-            cls.hasBuilder = True
-            cls.code = "IRBuilder<> *builder = Translator::getBuilder();\n" + cls.code
-        if cls.hasContext==False and cls.regexContext.search(code) != None:
-            cls.hasContext = True
-            cls.code = "LLVMContext& context = Translator::getContext();\n" + cls.code
-        if cls.hasModule==False and cls.regexModule.search(code) != None:
-            cls.hasModule = True
-            cls.code = "Module* module = Translator::getModule();\n" + cls.code
-        if cls.hasExecutionEngine == False and cls.regexExecutionEngine.search(code) != None:
-            cls.hasExecutionEngine = True
-            cls.code = "ExecutionEngine *execution_engine = Translator::getEE();\n" + cls.code
-    @classmethod
-    def append(cls, code):
-        cls.appendHelper(code)
-        cls.code += code
-    @classmethod
-    def appendLine(cls, code):
-        cls.appendHelper(code)
-        cls.code += code + '\n'
-    @classmethod
-    def getCode(cls):
-        return cls.code
+    # Declarations of the handles the generated code may use. Each one is
+    # put in front of the code the first time its handle is used, so they
+    # end up in the reverse order of first use. The declarations made with
+    # declare() follow them.
+    prologue = (
+        ("builder", "IRBuilder<> *builder = Translator::getBuilder();\n"),
+        ("context", "LLVMContext& context = Translator::getContext();\n"),
+        ("module", "Module* module = Translator::getModule();\n"),
+        ("execution_engine", "ExecutionEngine *execution_engine = Translator::getEE();\n"),
+        )
+    regexHandle = re.compile(r"(?<!\w)(builder|context|module|execution_engine)(?!\w)")
+    def __init__(self, sink=None):
+        if sink == None:
+            sink = StringSink()
+        self.sink = sink
+        self.handles = []
+        self.declarations = []
+    def appendHelper(self, code):
+        'record the handles ("builder", "context", ...) the code uses for the first time'
+        if len(self.handles) == len(self.prologue):
+            return
+        found = set(self.regexHandle.findall(code))
+        if not found:
+            return
+        for handle, declaration in self.prologue:
+            if handle in found and handle not in self.handles:
+                self.handles.append(handle)
+    def append(self, code):
+        self.appendHelper(code)
+        self.sink.write(code)
+    def appendLine(self, code):
+        self.appendHelper(code)
+        self.sink.write(code + '\n')
+    def declare(self, code):
+        'put a declaration in the prologue, so that all the code can use it'
+        self.appendHelper(code)
+        self.declarations.append(code + '\n')
+    def getPrologue(self):
+        declarations = dict(self.prologue)
+        return ("".join(declarations[handle] for handle in reversed(self.handles)) +
+                "".join(self.declarations))
+    def finish(self):
+        'hand the prologue to the sink; call this once the translation is over'
+        self.sink.finish(self.getPrologue())
+    def getCode(self):
+        return self.sink.getCode(self.getPrologue())
+
+# In SSA mode (TranslationContext.ssa) the scalar locals live in
+# ctx.ssaValues instead of allocas. A PhiJoin collects the values that
+# flow into a block along each of its incoming edges, and merges them
+# with phi nodes when the block is entered. The generators below add an
+# edge just before every branch they emit; outside SSA mode this does
+# nothing.
+class PhiJoin(object):
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.edges = []
+        self.phis = None
+    def addEdge(self, blockName=None, values=None):
+        '''record an edge into the block from blockName (default: the current
+        block) carrying values (default: the current values)'''
+        if not self.ctx.ssa:
+            return
+        if blockName == None:
+            blockName = self.ctx.getCurrentBlock()
+        if values == None:
+            values = dict(self.ctx.ssaValues)
+        if self.phis == None:
+            self.edges.append((blockName, values))
+            return
+        # the block was entered already; only the phis can take new values
+        for var, value in self.merged.items():
+            if var in self.phis:
+                self.ctx.emitter.appendLine("%s->addIncoming(%s, %s);" % (value, values[var], blockName))
+            elif values.get(var) != value:
+                raise UnhandledTranslationError
+    def enter(self, changing=()):
+        '''merge the values of the edges; call this right after the insert
+        point is set to the block. Phis are also made for the variables in
+        changing, which edges added after the block is entered may change.'''
+        if not self.ctx.ssa:
+            return
+        incoming = [values for blockName, values in self.edges]
+        self.phis = set()
+        if not incoming:
+            self.merged = dict(self.ctx.ssaValues)
+            return
+        self.merged = {}
+        for var, value in incoming[0].items():
+            values = [values.get(var) for values in incoming]
+            if None in values:
+                # declared in a scope that ends before this block
+                continue
+            if var not in changing and values.count(value) == len(values):
+                self.merged[var] = value
+                continue
+            phiName = self.ctx.temp.getTempName()
+            self.ctx.emitter.appendLine("PHINode *%s = builder->CreatePHI(%s, %d);" %
+                (phiName, var.type.getIRType(self.ctx), max(len(incoming), 2)))
+            for blockName, values in self.edges:
+                self.ctx.emitter.appendLine("%s->addIncoming(%s, %s);" % (phiName, values[var], blockName))
+            self.phis.add(var)
+            self.merged[var] = phiName
+        self.ctx.ssaValues = dict(self.merged)
 
 class BranchGenerator(object):
-    def __init__(self, condName=None, mayAppend=False):
+    def __init__(self, ctx, condName=None, mayAppend=False):
+        self.ctx = ctx
         self.state = "init"
         self.mayAppend = mayAppend
         self.condName = condName
-        self.trueBlockName = "trueBlock_%d" % Temp.getTempId()
-        self.falseBlockName = "falseBlock_%d" % Temp.getTempId()
-        self.exitBlockName = "exitBlock_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (self.trueBlockName, self.trueBlockName))
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (self.falseBlockName, self.falseBlockName))
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (self.exitBlockName, self.exitBlockName))
+        self.trueBlockName = "trueBlock_%d" % self.ctx.temp.getTempId()
+        self.falseBlockName = "falseBlock_%d" % self.ctx.temp.getTempId()
+        self.exitBlockName = "exitBlock_%d" % self.ctx.temp.getTempId()
+        self.exitJoin = PhiJoin(ctx)
+        self.ctx.createBlock(self.trueBlockName)
+        self.ctx.createBlock(self.falseBlockName)
+        self.ctx.createBlock(self.exitBlockName)
     def setCondName(self, condName):
         self.condName = condName
     def setMayAppend(self, mayAppend):
@@ -120,61 +183,64 @@ class BranchGenerator(object):
         assert self.state == "start condition"
         self.state = "end condition"
         assert self.condName != None
-        CodeEmitter.appendLine("builder->CreateCondBr(%s, %s, %s);" % (self.condName, self.trueBlockName, self.falseBlockName))
+        self.conditionValues = dict(self.ctx.ssaValues)
+        self.ctx.emitCondBranch(self.condName, self.trueBlockName, self.falseBlockName)
     def startTruePart(self):
         assert self.state == "end condition"
         self.state = "start true part"
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.trueBlockName)
+        self.ctx.enterBlock(self.trueBlockName)
     def endTruePart(self):
         assert self.state == "start true part"
         self.state = "end true part"
         if self.mayAppend:
-            self.truePartIP = "insert_point_of_true_%d" % Temp.getTempId()
-            CodeEmitter.appendLine("IRBuilder<>::InsertPoint %s = builder->saveIP();" % self.truePartIP)
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.exitBlockName)
+            self.truePartIP = "insert_point_of_true_%d" % self.ctx.temp.getTempId()
+            self.ctx.emitter.appendLine("IRBuilder<>::InsertPoint %s = builder->saveIP();" % self.truePartIP)
+        self.ctx.emitBranch(self.exitBlockName, self.exitJoin)
     def startFalsePart(self):
         assert self.state == "end true part"
         self.state = "start false part"
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.falseBlockName)
+        self.ctx.enterBlock(self.falseBlockName)
+        self.ctx.ssaValues = dict(self.conditionValues)
     def endFalsePart(self):
         assert self.state == "start false part"
         self.state = "end false part"
         if self.mayAppend:
-            self.falsePartIP = "insert_point_of_false_%d" % Temp.getTempId()
-            CodeEmitter.appendLine("IRBuilder<>::InsertPoint %s = builder->saveIP();" % self.falsePartIP)
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.exitBlockName)
+            self.falsePartIP = "insert_point_of_false_%d" % self.ctx.temp.getTempId()
+            self.ctx.emitter.appendLine("IRBuilder<>::InsertPoint %s = builder->saveIP();" % self.falsePartIP)
+        self.ctx.emitBranch(self.exitBlockName, self.exitJoin)
     def startAppendToTruePart(self):
         assert self.state == "end false part"
         self.state = "start append to true part"
-        self.IP = "insert_point_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("IRBuilder<>::InsertPoint %s = builder->saveIP();" % self.IP)
-        CodeEmitter.appendLine("builder->RestoreIP(%s);" % self.truePartIP)
+        self.IP = "insert_point_%d" % self.ctx.temp.getTempId()
+        self.ctx.emitter.appendLine("IRBuilder<>::InsertPoint %s = builder->saveIP();" % self.IP)
+        self.ctx.emitter.appendLine("builder->RestoreIP(%s);" % self.truePartIP)
     def endAppendToTruePart(self):
         assert self.state == "start append to true part"
         self.state = "end false part"
-        CodeEmitter.appendLine("builder->RestoreIP(%s);" % self.IP)
+        self.ctx.emitter.appendLine("builder->RestoreIP(%s);" % self.IP)
     def startAppendToFalsePart(self):
         assert self.state == "end false part"
         self.state = "start append to false part"
-        self.IP = "insert_point_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("IRBuilder<>::InsertPoint %s = builder->saveIP();" % self.IP)
-        CodeEmitter.appendLine("builder->RestoreIP(%s);" % self.falsePartIP)
+        self.IP = "insert_point_%d" % self.ctx.temp.getTempId()
+        self.ctx.emitter.appendLine("IRBuilder<>::InsertPoint %s = builder->saveIP();" % self.IP)
+        self.ctx.emitter.appendLine("builder->RestoreIP(%s);" % self.falsePartIP)
     def endAppendToFalsePart(self):
         assert self.state == "start append to false part"
         self.state = "end false part"
-        CodeEmitter.appendLine("builder->RestoreIP(%s);" % self.IP)
+        self.ctx.emitter.appendLine("builder->RestoreIP(%s);" % self.IP)
     def startExitPart(self):
         assert self.state == "end false part"
         self.state = "start exit part"
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.exitBlockName)
+        self.ctx.enterBlock(self.exitBlockName)
+        self.exitJoin.enter()
     def endExitPart(self):
         assert self.state == "start exit part"
         self.state = "end exit part"
     def addPhi(self, name, irType, condTrueValue, condFalseValue):
         assert self.state == "start exit part"
-        CodeEmitter.appendLine("PHINode *%s = builder->CreatePHI(%s, 2);" % (name, irType))
-        CodeEmitter.appendLine("%s->addIncoming(%s, %s);" % (name, condTrueValue, self.trueBlockName))
-        CodeEmitter.appendLine("%s->addIncoming(%s, %s);" % (name, condFalseValue, self.falseBlockName))
+        self.ctx.emitter.appendLine("PHINode *%s = builder->CreatePHI(%s, 2);" % (name, irType))
+        self.ctx.emitter.appendLine("%s->addIncoming(%s, %s);" % (name, condTrueValue, self.trueBlockName))
+        self.ctx.emitter.appendLine("%s->addIncoming(%s, %s);" % (name, condFalseValue, self.falseBlockName))
 
 class LoopType(object):
     WHILE = 0
@@ -182,62 +248,86 @@ class LoopType(object):
     FOR = 2
 
 class LoopGenerator(object):
-    def __init__(self, loopType, condName=None):
+    '''statement is the loop being translated; in SSA mode the variables it
+    assigns get phis in the block the loop starts over from'''
+    def __init__(self, ctx, loopType, condName=None, statement=None):
+        self.ctx = ctx
         self.loopType = loopType
+        self.statement = statement
+        # the condition block, or the body of a do-while loop
+        self.headerJoin = PhiJoin(ctx)
+        # the condition block of a do-while loop, or the post body block of a for loop
+        self.continueJoin = PhiJoin(ctx)
+        self.exitJoin = PhiJoin(ctx)
         self.state = "init"
         self.condName = condName
-        self.condBlockName = "cond_block_%d" % Temp.getTempId()
-        self.bodyBlockName = "body_block_%d" % Temp.getTempId()
-        self.exitBlockName = "exit_block_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (self.condBlockName, self.condBlockName))
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (self.bodyBlockName, self.bodyBlockName))
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (self.exitBlockName, self.exitBlockName))
+        self.condBlockName = "cond_block_%d" % self.ctx.temp.getTempId()
+        self.bodyBlockName = "body_block_%d" % self.ctx.temp.getTempId()
+        self.exitBlockName = "exit_block_%d" % self.ctx.temp.getTempId()
+        self.ctx.createBlock(self.condBlockName)
+        self.ctx.createBlock(self.bodyBlockName)
+        self.ctx.createBlock(self.exitBlockName)
         if loopType == LoopType.FOR:
-            self.postLoopBodyBlockName = "post_body_block_%d" % Temp.getTempId()
-            CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-                (self.postLoopBodyBlockName, self.postLoopBodyBlockName))
+            self.postLoopBodyBlockName = "post_body_block_%d" % self.ctx.temp.getTempId()
+            self.ctx.createBlock(self.postLoopBodyBlockName)
     def setCondName(self, condName):
         self.condName = condName
+    def enterHeader(self):
+        if self.ctx.ssa:
+            names = assignedNames(self.statement)
+            changing = [var for var in self.ctx.ssaValues
+                        if var.name in names and self.ctx.variableTable.get(var.name) is var]
+            self.headerJoin.enter(changing=changing)
+    def getContinueJoin(self):
+        if self.loopType == LoopType.WHILE:
+            return self.headerJoin
+        return self.continueJoin
     def startCondition(self):
         if self.loopType == LoopType.DO_WHILE:
             assert self.state == "end loop body"
         else:
             assert self.state == "init"
-            CodeEmitter.appendLine("builder->CreateBr(%s);" % self.condBlockName)
+            self.ctx.emitBranch(self.condBlockName, self.headerJoin)
         self.state = "start condition"
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.condBlockName)
+        self.ctx.enterBlock(self.condBlockName)
+        if self.loopType == LoopType.DO_WHILE:
+            self.continueJoin.enter()
+        else:
+            self.enterHeader()
     def endCondition(self):
         assert self.state == "start condition"
         self.state = "end condition"
         assert self.condName != None
-        CodeEmitter.appendLine("builder->CreateCondBr(%s, %s, %s);" % (self.condName, self.bodyBlockName, self.exitBlockName))
+        if self.ctx.ssa:
+            blockName = self.ctx.getCurrentBlock()
+            if self.loopType == LoopType.DO_WHILE:
+                self.headerJoin.addEdge(blockName)
+            self.exitJoin.addEdge(blockName)
+        self.ctx.emitCondBranch(self.condName, self.bodyBlockName, self.exitBlockName)
     def startLoopBody(self):
         if self.loopType == LoopType.DO_WHILE:
             assert self.state == "init"
-            CodeEmitter.appendLine("builder->CreateBr(%s);" % self.bodyBlockName)
+            self.ctx.emitBranch(self.bodyBlockName, self.headerJoin)
         else:
             assert self.state == "end condition"
         self.state = "start loop body"
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.bodyBlockName)
+        self.ctx.enterBlock(self.bodyBlockName)
+        if self.loopType == LoopType.DO_WHILE:
+            self.enterHeader()
     def endLoopBody(self):
         assert self.state == "start loop body"
         self.state = "end loop body"
-        if self.loopType == LoopType.FOR:
-            CodeEmitter.appendLine("builder->CreateBr(%s);" % self.postLoopBodyBlockName)
-        else:
-            CodeEmitter.appendLine("builder->CreateBr(%s);" % self.condBlockName)
+        self.branchToContinue()
     def startPostLoopBodyPart(self):
         assert self.loopType == LoopType.FOR
         assert self.state == "end loop body"
         self.state = "start post loop body part"
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.postLoopBodyBlockName)
+        self.ctx.enterBlock(self.postLoopBodyBlockName)
+        self.continueJoin.enter()
     def endPostLoopBodyPart(self):
         assert self.state == "start post loop body part"
         self.state = "end post loop body part"
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.condBlockName)
+        self.ctx.emitBranch(self.condBlockName, self.headerJoin)
     def startExitPart(self):
         if self.loopType == LoopType.DO_WHILE:
             assert self.state == "end condition"
@@ -246,147 +336,127 @@ class LoopGenerator(object):
         else:
             assert self.state == "end loop body"
         self.state = "start exit part"
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.exitBlockName)
+        self.ctx.enterBlock(self.exitBlockName)
+        self.exitJoin.enter()
     def endExitPart(self):
         assert self.state == "start exit part"
         self.state = "end exit part"
+    def branchToContinue(self):
+        if self.loopType == LoopType.FOR:
+            self.ctx.emitBranch(self.postLoopBodyBlockName, self.continueJoin)
+        else:
+            self.ctx.emitBranch(self.condBlockName, self.getContinueJoin())
+    # The code after 'break' and 'continue' gets a block when there is some
+    # (see TranslationContext.reopenBlock).
     def startBreak(self):
         assert self.state == "start loop body"
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.exitBlockName)
-        # Add a basic block and no one will reach it, then it will be eliminated by LLVM.
-        # This trick is to ease the translation of branches with 'break' statement.
-        tempBlockName = "never_been_reached_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (tempBlockName, tempBlockName))
-        CodeEmitter.append("builder->SetInsertPoint(%s);" % tempBlockName)
-        # add an 'unreachable' instruction for safety.
-        CodeEmitter.append("builder->CreateUnreachable();")
+        self.ctx.emitBranch(self.exitBlockName, self.exitJoin)
     def endBreak(self):
         pass
     def startContinue(self):
         assert self.state == "start loop body"
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.postLoopBodyBlockName)
-        # Add a basic block and no one will reach it, then it will be eliminated by LLVM.
-        # This trick is to ease the translation of branches with 'continue' statement.
-        tempBlockName = "never_been_reached_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (tempBlockName, tempBlockName))
-        CodeEmitter.append("builder->SetInsertPoint(%s);" % tempBlockName)
-        # add an 'unreachable' instruction for safety.
-        CodeEmitter.append("builder->CreateUnreachable();")
+        self.branchToContinue()
     def endContinue(self):
         pass
 
+# A switch statement is lowered to one SwitchInst, created before its
+# cases are known: it starts with the exit block as its default
+# destination, and every case label and the default body are added to it
+# as they are translated. LLVM can then turn it into a jump table or bit
+# tests instead of a chain of comparisons.
 class SwitchGenerator(object):
-    def __init__(self, control):
+    def __init__(self, ctx, control):
         assert isinstance(control, TranslationResult)
+        self.ctx = ctx
         self.control = control
-        self.exitBlockName = "exit_block_%d" % Temp.getTempId()
-        self.nextCaseBlockName = "case_block_%d" % Temp.getTempId()
-        self.nextCaseBodyBlockName = self.nextCaseBlockName + "_body"
-        self.defaultBodyBlockName = None
+        self.exitBlockName = "exit_block_%d" % self.ctx.temp.getTempId()
+        self.switchName = "switch_%d" % self.ctx.temp.getTempId()
+        self.headBlockName = None
+        self.hasDefault = False
         self.state = "init"
-        self.isDefaultAtLast = False
+        self.exitJoin = PhiJoin(ctx)
     def startSwtich(self):
         assert self.state == "init"
         self.state = "in switch"
         if not isinstance(self.control.type, IntType):
-            self.control = TypeCaster.castTo(IntType(True, 64), self.control)
-        CodeEmitter.appendLine('BasicBlock *%s = BasicBlock::Create(context, "%s", Translator::getCurFunc());' % 
-            (self.nextCaseBlockName, self.nextCaseBlockName))
-        CodeEmitter.appendLine('BasicBlock *%s = BasicBlock::Create(context, "%s", Translator::getCurFunc());' % 
-            (self.exitBlockName, self.exitBlockName))
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.nextCaseBlockName)
-
-        # Add a basic block and no one will reach it, then it will be eliminated by LLVM.
-        # This trick is to ease the translation of 'case' statement.
-        tempBlockName = "never_been_reached_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (tempBlockName, tempBlockName))
-        CodeEmitter.append("builder->SetInsertPoint(%s);" % tempBlockName)
-        # add an 'unreachable' instruction for safety.
-        CodeEmitter.append("builder->CreateUnreachable();")
+            self.control = TypeCaster.castTo(self.ctx, IntType(True, 64), self.control)
+        self.ctx.createBlock(self.exitBlockName)
+        # the case bodies only see the values from here
+        self.headValues = dict(self.ctx.ssaValues)
+        if self.ctx.ssa:
+            self.headBlockName = self.ctx.getCurrentBlock()
+        self.ctx.emitter.appendLine("SwitchInst *%s = builder->CreateSwitch(%s, %s);" %
+            (self.switchName, self.control.value, self.exitBlockName))
+        # the first case starts a new block
+        self.ctx.terminated = True
     def startBreak(self):
         assert self.state == "in switch"
         self.state = "in break"
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.exitBlockName)
-        # Add a basic block and no one will reach it, then it will be eliminated by LLVM.
-        # This trick is to ease the translation of branches and cases with 'break' statement.
-        tempBlockName = "never_been_reached_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("BasicBlock *%s = BasicBlock::Create(context, \"%s\", Translator::getCurFunc());" %
-            (tempBlockName, tempBlockName))
-        CodeEmitter.append("builder->SetInsertPoint(%s);" % tempBlockName)
-        # add an 'unreachable' instruction for safety.
-        CodeEmitter.append("builder->CreateUnreachable();")
-        pass
+        self.ctx.emitBranch(self.exitBlockName, self.exitJoin)
     def endBreak(self):
         assert self.state == "in break"
         self.state = "in switch"
         pass
+    def startBody(self, bodyBlockName):
+        'fall through from the previous body into a new one, which the switch also branches to'
+        self.ctx.createBlock(bodyBlockName)
+        bodyJoin = PhiJoin(self.ctx)
+        # unless the previous case body ended with 'break'
+        self.ctx.emitBranch(bodyBlockName, bodyJoin)
+        bodyJoin.addEdge(self.headBlockName, self.headValues)
+        return bodyJoin
     def addCase(self, case):
         assert self.state == "in switch"
         assert isinstance(case, Constant)
 
-        caseBlockName = self.nextCaseBlockName
-        caseBodyBlockName = self.nextCaseBodyBlockName
-        self.nextCaseBlockName = "case_block_%d" % Temp.getTempId()
-        self.nextCaseBodyBlockName = self.nextCaseBlockName + "_body"
-
-        #Jump to the body of this case. If the previous case body has 'break', this 'br' instruction will be eliminated by LLVM
-        CodeEmitter.appendLine('BasicBlock *%s = BasicBlock::Create(context, "%s", Translator::getCurFunc());' %
-            (caseBodyBlockName, caseBodyBlockName))
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % caseBodyBlockName)
-
-        CodeEmitter.appendLine('BasicBlock *%s = BasicBlock::Create(context, "%s", Translator::getCurFunc());' %
-            (self.nextCaseBlockName, self.nextCaseBlockName))
-
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % caseBlockName)
-        caseResult = case.translate()
-        newCaseResult = TypeCaster.castTo(self.control.type, caseResult)
-        isEqual = Temp.getTempName()
-        CodeEmitter.appendLine("Value *%s = builder->CreateICmpEQ(%s, %s);" % (isEqual, self.control.value, newCaseResult.value))
-        CodeEmitter.appendLine("builder->CreateCondBr(%s, %s, %s);" % (isEqual, caseBodyBlockName, self.nextCaseBlockName))
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % caseBodyBlockName)
+        caseBodyBlockName = "case_block_%d_body" % self.ctx.temp.getTempId()
+        bodyJoin = self.startBody(caseBodyBlockName)
+        caseResult = case.translate(self.ctx)
+        # the cast of a constant is folded by the builder, so it is still a ConstantInt
+        newCaseResult = TypeCaster.castTo(self.ctx, self.control.type, caseResult)
+        self.ctx.emitter.appendLine("%s->addCase(cast<ConstantInt>(%s), %s);" %
+            (self.switchName, newCaseResult.value, caseBodyBlockName))
+        self.ctx.enterBlock(caseBodyBlockName)
+        bodyJoin.enter()
 
     def addDefault(self):
         assert self.state == "in switch"
-        self.defaultBodyBlockName = "default_body_%d" % Temp.getTempId()
-        CodeEmitter.appendLine('BasicBlock *%s = BasicBlock::Create(context, "%s", Translator::getCurFunc());' %
-            (self.defaultBodyBlockName, self.defaultBodyBlockName))
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.defaultBodyBlockName)
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.defaultBodyBlockName)
+        self.hasDefault = True
+        defaultBodyBlockName = "default_body_%d" % self.ctx.temp.getTempId()
+        bodyJoin = self.startBody(defaultBodyBlockName)
+        self.ctx.emitter.appendLine("%s->setDefaultDest(%s);" % (self.switchName, defaultBodyBlockName))
+        self.ctx.enterBlock(defaultBodyBlockName)
+        bodyJoin.enter()
 
     def endSwitch(self):
         assert self.state == "in switch"
         self.state = "out of switch"
 
         # let the last case body jump to exit if it does not has a break
-        CodeEmitter.appendLine("builder->CreateBr(%s);" % self.exitBlockName)
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.nextCaseBlockName)
-        if self.defaultBodyBlockName != None:
-            CodeEmitter.appendLine("builder->CreateBr(%s);" % self.defaultBodyBlockName)
-        else:
-            CodeEmitter.appendLine("builder->CreateBr(%s);" % self.exitBlockName)
-        CodeEmitter.appendLine("builder->SetInsertPoint(%s);" % self.exitBlockName)
+        self.ctx.emitBranch(self.exitBlockName, self.exitJoin)
+        if not self.hasDefault:
+            self.exitJoin.addEdge(self.headBlockName, self.headValues)
+        self.ctx.enterBlock(self.exitBlockName)
+        self.exitJoin.enter()
 
 class Temp(object):
-    i = 0
-    @classmethod
-    def getTempName(cls):
-        cls.i += 1
-        return 't' + str(cls.i)
-    @classmethod
-    def getTempId(cls):
-        cls.i += 1
-        return cls.i
-    @classmethod
-    def reset(cls):
-        cls.i = 0
+    def __init__(self):
+        self.i = 0
+    def getTempName(self):
+        self.i += 1
+        return 't' + str(self.i)
+    def getTempId(self):
+        self.i += 1
+        return self.i
+    def reset(self):
+        self.i = 0
 
 class TranslationResult(object):
-    def __init__(self, type, value):
+    def __init__(self, type, value, signExtendedFrom=None):
         self.type = type
         self.value = value
+        # the width the value is known to be sign-extended from, if any
+        self.signExtendedFrom = signExtendedFrom
     def __str__(self):
         return "%s:%s" % (str(self.value), str(self.type))
     def __repr__(self):
@@ -402,81 +472,106 @@ class TypeCompareResult(object):
 
 class TypeCaster(object):
     @classmethod
-    def integralPromotion(cls, input):
+    def integralPromotion(cls, ctx, input):
         if isinstance(input, IntType):
-            if input.type.compare(IntType()) == TypeCompareResult.LT:
-                return cls.castTo(IntType(), input)
+            if input.type.compare(ctx, IntType()) == TypeCompareResult.LT:
+                return cls.castTo(ctx, IntType(), input)
         return input
     @classmethod
-    def castForArithmetic(cls, result1, result2):
+    def castForArithmetic(cls, ctx, result1, result2):
         assert isinstance(result1, TranslationResult)
         assert isinstance(result2, TranslationResult)
         try:
-            result1 = cls.integralPromotion(result1)
-            result2 = cls.integralPromotion(result2)
+            result1 = cls.integralPromotion(ctx, result1)
+            result2 = cls.integralPromotion(ctx, result2)
             type1 = result1.type
             type2 = result2.type
-            if type1.compare(type2) == TypeCompareResult.EQ:
+            if type1.compare(ctx, type2) == TypeCompareResult.EQ:
                 return (result1, result2)
-            elif type1.compare(type2) == TypeCompareResult.GT:
-                newResult2 = cls.castTo(type1, result2)
+            elif type1.compare(ctx, type2) == TypeCompareResult.GT:
+                newResult2 = cls.castTo(ctx, type1, result2)
                 return (result1, newResult2)
-            elif type1.compare(type2) == TypeCompareResult.LT:
-                newResult1 = cls.castTo(type2, result1)
+            elif type1.compare(ctx, type2) == TypeCompareResult.LT:
+                newResult1 = cls.castTo(ctx, type2, result1)
                 return (newResult1, result2)
             else:
                 raise TypeCastError
         except TypeCompareError:
             raise TypeCastError
     @classmethod
-    def castTo(cls, targetType, input):
+    def castTo(cls, ctx, targetType, input):
         assert isinstance(input, TranslationResult)
-        if targetType.compare(input.type) == TypeCompareResult.EQ:
+        if targetType.compare(ctx, input.type) == TypeCompareResult.EQ:
             return input
-        return targetType.castTo(input)
+        return targetType.castTo(ctx, input)
 
 class Type(object):
     def __repr__(self):
         return self.__str__()
-    def compare(self, other):
+    def compare(self, ctx, other):
         raise TypeCompareError
-    def getIRType(self):
+    def getIRType(self, ctx):
         raise UnhandledTranslationError
-    def getBytes(self):
+    def getIRTypeHandle(self, ctx):
+        '''name of the handle of the IR type if it is declared in the prologue
+        (see TranslationContext.declareIRType), or None'''
+        return None
+    def getBytes(self, ctx):
         raise UnhandledTranslationError
-    def castTo(self, inputResult):
+    def castTo(self, ctx, inputResult):
         raise UnhandledTranslationError
 
-class VoidType(Type):
+# Types are interned: the types without parameters have one instance each,
+# and IntType(False, 1) always returns the same object.
+class SingletonType(Type):
+    def __new__(cls):
+        instance = cls.__dict__.get("instance")
+        if instance == None:
+            instance = Type.__new__(cls)
+            cls.instance = instance
+        return instance
+    def __reduce__(self):
+        return (type(self), ())
+
+class VoidType(SingletonType):
     def __str__(self):
         return 'void'
-    def getIRType(self):
-        typeName = Temp.getTempName()
-        CodeEmitter.appendLine("Type *%s = Type::getVoidTy(context);" % typeName)
-        return typeName
-    def compare(self, other):
+    def getIRType(self, ctx):
+        return ctx.declareIRType("type_void", "Type *type_void = Type::getVoidTy(context);")
+    def getIRTypeHandle(self, ctx):
+        return "type_void"
+    def compare(self, ctx, other):
         if isinstance(other, TypeIDType):
-            other = other.getActualType()
+            other = other.getActualType(ctx)
         if isinstance(other, VoidType):
             return TypeCompareResult.EQ
         else:
             return TypeCompareResult.INCOMPARABLE
-    def getBytes(self):
+    def getBytes(self, ctx):
         return 0
 
 class IntType(Type):
-    def __init__(self, isSigned=True, size=struct.calcsize("i")*8):
-        self.isSigned = isSigned
-        self.size = size
+    instances = {}
+    def __new__(cls, isSigned=True, size=struct.calcsize("i")*8):
+        key = (cls, bool(isSigned), size)
+        instance = IntType.instances.get(key)
+        if instance == None:
+            instance = Type.__new__(cls)
+            instance.isSigned = bool(isSigned)
+            instance.size = size
+            IntType.instances[key] = instance
+        return instance
+    def __reduce__(self):
+        return (type(self), (self.isSigned, self.size))
     def __str__(self):
         s = ""
         if not self.isSigned:
             s += 'u'
         s += "int%d_t" % self.size
         return s
-    def compare(self, other):
+    def compare(self, ctx, other):
         if isinstance(other, TypeIDType):
-            other = other.getActualType()
+            other = other.getActualType(ctx)
         if isinstance(other, FloatType) or isinstance(other, DoubleType):
             return -1
         elif isinstance(other, IntType):
@@ -498,47 +593,48 @@ class IntType(Type):
                     return TypeCompareResult.LT
         else:
             raise TypeCompareError
-    def getIRType(self):
-        typeName = Temp.getTempName()
-        CodeEmitter.appendLine("Type *%s = Type::getIntNTy(context, %d);" % (typeName, self.size))
-        return typeName
-    def getBytes(self):
+    def getIRType(self, ctx):
+        typeName = "type_i%d" % self.size
+        return ctx.declareIRType(typeName, "Type *%s = Type::getIntNTy(context, %d);" % (typeName, self.size))
+    def getIRTypeHandle(self, ctx):
+        return "type_i%d" % self.size
+    def getBytes(self, ctx):
         return (self.size+7)/8
-    def castTo(self, input):
+    def castTo(self, ctx, input):
         assert isinstance(input, TranslationResult)
-        newValue = Temp.getTempName()
-        typeName = self.getIRType()
+        newValue = ctx.temp.getTempName()
+        typeName = self.getIRType(ctx)
         if self.isSigned:
             isSigned = "true"
         else:
             isSigned = "false"
-        CodeEmitter.appendLine("Value *%s = builder->CreateIntCast(%s, %s, %s);" % (newValue, input.value, typeName, isSigned))
+        ctx.emitter.appendLine("Value *%s = builder->CreateIntCast(%s, %s, %s);" % (newValue, input.value, typeName, isSigned))
         return TranslationResult(self, newValue)
 
-class Twin64Type(Type):
+class Twin64Type(SingletonType):
     def __str__(self):
         return "Twin64_t"
-    def getIRType(self):
-        typeName = "twin64_t_%d" % (Temp.getTempId())
-        CodeEmitter.appendLine("StructType *%s = module->getTypeByName(\"Twin64_t\");" % (typeName))
-        CodeEmitter.appendLine("if(!%s){" % typeName);
-        typeVectorName = "typeVector_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("std::vector<Type *> %s;" % typeVectorName)
+    def getIRType(self, ctx):
+        typeName = "twin64_t_%d" % (ctx.temp.getTempId())
+        ctx.emitter.appendLine("StructType *%s = module->getTypeByName(\"Twin64_t\");" % (typeName))
+        ctx.emitter.appendLine("if(!%s){" % typeName);
+        typeVectorName = "typeVector_%d" % ctx.temp.getTempId()
+        ctx.emitter.appendLine("std::vector<Type *> %s;" % typeVectorName)
         intType = IntType(size=64, isSigned=True)
-        CodeEmitter.appendLine("%s.push_back(%s);" % (typeVectorName, intType.getIRType()))
-        CodeEmitter.appendLine("%s.push_back(%s);" % (typeVectorName, intType.getIRType()))
-        CodeEmitter.appendLine("%s = StructType::create(%s, \"Twin64_t\");" % (typeName, typeVectorName))
-        CodeEmitter.appendLine("}");
+        ctx.emitter.appendLine("%s.push_back(%s);" % (typeVectorName, intType.getIRType(ctx)))
+        ctx.emitter.appendLine("%s.push_back(%s);" % (typeVectorName, intType.getIRType(ctx)))
+        ctx.emitter.appendLine("%s = StructType::create(%s, \"Twin64_t\");" % (typeName, typeVectorName))
+        ctx.emitter.appendLine("}");
         return structTypeName
-    def getBytes(self):
+    def getBytes(self, ctx):
         return 16
 
-class FloatType(Type):
+class FloatType(SingletonType):
     def __str__(self):
         return 'float'
-    def compare(self, other):
+    def compare(self, ctx, other):
         if isinstance(other, TypeIDType):
-            other = other.getActualType()
+            other = other.getActualType(ctx)
         if isinstance(other, DoubleType):
             return TypeCompareResult.LT
         elif isinstance(other, FloatType):
@@ -547,42 +643,42 @@ class FloatType(Type):
             return TypeCompareResult.GT
         else:
             raise TypeCompareError
-    def getIRType(self):
-        typeName = Temp.getTempName()
-        CodeEmitter.appendLine("Type *%s = Type::getFloatTy(context);" % (typeName))
-        return typeName
-    def getBytes(self):
+    def getIRType(self, ctx):
+        return ctx.declareIRType("type_float", "Type *type_float = Type::getFloatTy(context);")
+    def getIRTypeHandle(self, ctx):
+        return "type_float"
+    def getBytes(self, ctx):
         return struct.calcsize("f")
-    def castTo(self, input):
+    def castTo(self, ctx, input):
         assert isinstance(input, TranslationResult)
-        newValue = Temp.getTempName()
-        typeName = self.getIRType()
-        CodeEmitter.appendLine("Value *%s = builder->CreateFPCast(%s, %s);" %(newValue, input.value, typeName))
+        newValue = ctx.temp.getTempName()
+        typeName = self.getIRType(ctx)
+        ctx.emitter.appendLine("Value *%s = builder->CreateFPCast(%s, %s);" %(newValue, input.value, typeName))
         return TranslationResult(self, newValue)
 
-class DoubleType(Type):
+class DoubleType(SingletonType):
     def __str__(self):
         return 'double'
-    def compare(self, other):
+    def compare(self, ctx, other):
         if isinstance(other, TypeIDType):
-            other = other.getActualType()
+            other = other.getActualType(ctx)
         if isinstance(other, DoubleType):
             return TypeCompareResult.EQ
         elif isinstance(other, FloatType) or isinstance(other, IntType):
             return TypeCompareResult.GT
         else:
             raise TypeCompareError
-    def getIRType(self):
-        typeName = Temp.getTempName()
-        CodeEmitter.appendLine("Type *%s = Type::getDoubleTy(context);" % (typeName))
-        return typeName
-    def getBytes(self):
+    def getIRType(self, ctx):
+        return ctx.declareIRType("type_double", "Type *type_double = Type::getDoubleTy(context);")
+    def getIRTypeHandle(self, ctx):
+        return "type_double"
+    def getBytes(self, ctx):
         return struct.calcsize("d")
-    def castTo(self, input):
+    def castTo(self, ctx, input):
         assert isinstance(input, TranslationResult)
-        newValue = Temp.getTempName()
-        typeName = self.getIRType()
-        CodeEmitter.appendLine("Value *%s = builder->CreateFPCast(%s, %s);" %(newValue, input.value, typeName))
+        newValue = ctx.temp.getTempName()
+        typeName = self.getIRType(ctx)
+        ctx.emitter.appendLine("Value *%s = builder->CreateFPCast(%s, %s);" %(newValue, input.value, typeName))
         return TranslationResult(self, newValue)
 
 class EnumType(IntType):
@@ -593,18 +689,20 @@ class TypeIDType(Type):
         self.typeID = typeID
     def __str__(self):
         return self.typeID
-    def getActualType(self):
-        t = typeIDTable.get(self.typeID)
+    def getActualType(self, ctx):
+        t = ctx.typeIDTable.get(self.typeID)
         assert t != None
         return t
-    def getIRType(self):
-        return self.getActualType().getIRType()
-    def getBytes(self):
-        return self.getActualType().getBytes()
-    def compare(self, other):
-        return self.getActualType().compare(other)
-    def castTo(self, input):
-        return self.getActualType().castTo(input)
+    def getIRType(self, ctx):
+        return self.getActualType(ctx).getIRType(ctx)
+    def getIRTypeHandle(self, ctx):
+        return self.getActualType(ctx).getIRTypeHandle(ctx)
+    def getBytes(self, ctx):
+        return self.getActualType(ctx).getBytes(ctx)
+    def compare(self, ctx, other):
+        return self.getActualType(ctx).compare(ctx, other)
+    def castTo(self, ctx, input):
+        return self.getActualType(ctx).castTo(ctx, input)
 
 class PointerType(Type):
     def __init__(self, baseType=None, level=1):
@@ -618,31 +716,39 @@ class PointerType(Type):
         for i in range(self.level):
             s += "*"
         return s
-    def getIRType(self):
-        baseTypeName = self.baseType.getIRType()
+    def getIRType(self, ctx):
+        baseTypeName = self.baseType.getIRType(ctx)
+        typeName = self.getIRTypeHandle(ctx)
+        if typeName != None:
+            return ctx.declareIRType(typeName, "PointerType *%s = %s->getPointerTo();" % (typeName, baseTypeName))
         for i in range(self.level):
-            typeName = Temp.getTempName()
-            CodeEmitter.appendLine("PointerType *%s = %s->getPointerTo();" % (typeName, baseTypeName))
+            typeName = ctx.temp.getTempName()
+            ctx.emitter.appendLine("PointerType *%s = %s->getPointerTo();" % (typeName, baseTypeName))
             baseTypeName = typeName
         return typeName
-    def compare(self, other):
+    def getIRTypeHandle(self, ctx):
+        baseTypeName = self.baseType.getIRTypeHandle(ctx)
+        if baseTypeName == None or self.level != 1:
+            return None
+        return baseTypeName + "_ptr"
+    def compare(self, ctx, other):
         if isinstance(other, TypeIDType):
-            other = other.getActualType()
+            other = other.getActualType(ctx)
         if isinstance(other, PointerType):
-            compareResult = self.baseType.compare(other.baseType)
+            compareResult = self.baseType.compare(ctx, other.baseType)
             if compareResult == TypeCompareResult.EQ:
                 return TypeCompareResult.EQ
             else:
                 return TypeCompareResult.INCOMPARABLE
         else:
             return TypeCompareResult.INCOMPARABLE
-    def getBytes(self):
+    def getBytes(self, ctx):
         return struct.calcsize("P")
-    def castTo(self, input):
+    def castTo(self, ctx, input):
         assert isinstance(input, TranslationResult)
-        newValue = Temp.getTempName()
-        typeName = self.getIRType()
-        CodeEmitter.appendLine("Value *%s = builder->CreatePointerCast(%s, %s);" % (newValue, input.value, typeName))
+        newValue = ctx.temp.getTempName()
+        typeName = self.getIRType(ctx)
+        ctx.emitter.appendLine("Value *%s = builder->CreatePointerCast(%s, %s);" % (newValue, input.value, typeName))
         return TranslationResult(self, newValue)
 
 
@@ -651,8 +757,6 @@ class StructUnionBaseType(Type):
     def __init__(self, name=None, definition=None):
         self.name = name
         self.definition = definition
-        self.irTypeName = None
-        self.fullType = None
         self.fullName = None
     def __str__(self):
         s = self.structUnion + " "
@@ -672,56 +776,52 @@ class StructUnionBaseType(Type):
             else:
                 self.fullName = self.structUnion
         return self.fullName
-    def getFullType(self):
-        if self.fullType == None:
-            if self.definition != None:
-                self.fullType = self
-            else:
-                t = typeIDTable.get(self.getFullName())
-                assert t != None
-                self.fullType = t
-        return self.fullType
-    def compare(self, other):
+    def getFullType(self, ctx):
+        if self.definition != None:
+            return self
+        t = ctx.typeIDTable.get(self.getFullName())
+        assert t != None
+        return t
+    def compare(self, ctx, other):
         if isinstance(other, TypeIDType):
-            other = other.getActualType()
+            other = other.getActualType(ctx)
         if not isinstance(other, StructUnionBaseType):
             return TypeCompareResult.INCOMPARABLE
-        if self.getFullType() == other.getFullType():
+        if self.getFullType(ctx) == other.getFullType(ctx):
             return TypeCompareResult.EQ
         else:
             return TypeCompareResult.INCOMPARABLE
 
 class StructType(StructUnionBaseType):
     structUnion = "struct"
-    def getIRType(self):
-        fullType = self.getFullType()
-        structTypeName = "%s_%d" % (self.getFullName(), Temp.getTempId())
-        if fullType.irTypeName == None:
-            fullType.irTypeName = structTypeName
-        CodeEmitter.appendLine("StructType *%s = module->getTypeByName(\"%s\");" % (structTypeName, fullType.irTypeName))
-        CodeEmitter.appendLine("if(!%s){" % structTypeName);
-        fieldTypeVectorName = "fieldTypeVector_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("std::vector<Type *> %s;" % fieldTypeVectorName)
+    def getIRType(self, ctx):
+        fullType = self.getFullType(ctx)
+        structTypeName = "%s_%d" % (self.getFullName(), ctx.temp.getTempId())
+        irTypeName = ctx.structIRTypeNames.setdefault(fullType, structTypeName)
+        ctx.emitter.appendLine("StructType *%s = module->getTypeByName(\"%s\");" % (structTypeName, irTypeName))
+        ctx.emitter.appendLine("if(!%s){" % structTypeName);
+        fieldTypeVectorName = "fieldTypeVector_%d" % ctx.temp.getTempId()
+        ctx.emitter.appendLine("std::vector<Type *> %s;" % fieldTypeVectorName)
         for field in fullType.definition:
             assert isinstance(field, VariableDeclarator)
-            fieldTypeName = field.variable.type.getIRType()
-            CodeEmitter.appendLine("%s.push_back(%s);" % (fieldTypeVectorName, fieldTypeName))
-        CodeEmitter.appendLine("%s = StructType::create(%s, \"%s\");" % (structTypeName, fieldTypeVectorName, fullType.irTypeName))
-        CodeEmitter.appendLine("}");
+            fieldTypeName = field.variable.type.getIRType(ctx)
+            ctx.emitter.appendLine("%s.push_back(%s);" % (fieldTypeVectorName, fieldTypeName))
+        ctx.emitter.appendLine("%s = StructType::create(%s, \"%s\");" % (structTypeName, fieldTypeVectorName, irTypeName))
+        ctx.emitter.appendLine("}");
         return structTypeName
-    def getBytes(self):
+    def getBytes(self, ctx):
         # Here I assume that all fields align to its bytes boundary. This might not be right, be cautious.
         bytes = 0
-        fullType = self.getFullType()
+        fullType = self.getFullType(ctx)
         for field in fullType.definition:
             assert isinstance(field, VariableDeclarator)
-            fieldBytes = field.variable.type.getBytes()
+            fieldBytes = field.variable.type.getBytes(ctx)
             if bytes % fieldBytes != 0:
                 bytes += fieldBytes - bytes % fieldBytes
             bytes += fieldBytes
         return bytes
-    def getFieldPointerByName(self, name, structPointer):
-        fullType = self.getFullType()
+    def getFieldPointerByName(self, ctx, name, structPointer):
+        fullType = self.getFullType(ctx)
         index = 0
         fieldType = None
         for field in fullType.definition:
@@ -732,45 +832,42 @@ class StructType(StructUnionBaseType):
             index += 1
         else:
             raise UnhandledTranslationError
-        indexVectorName = "index_vector_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("std::vector<Value *> %s;" % indexVectorName)
-        zero = "zero_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("Value *%s = getImm(0);" % zero)
-        indexName = "index_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("Value *%s = getImm(%d)" % (indexName, index))
-        CodeEmitter.appendLine("%s.push_back(%s);" % (indexVectorName, zero))
-        CodeEmitter.appendLine("%s.push_back(%s);" % (indexVectorName, indexName))
-        fieldPointerName = "%s_%s_%d" % (self.getFullName(), name, Temp.getTempId())
-        CodeEmitter.appendLine("Value *%s = builder->CreateGEP(%s, %s);" % (fieldPointerName, structPointer, indexVectorName))
+        indexVectorName = "index_vector_%d" % ctx.temp.getTempId()
+        ctx.emitter.appendLine("std::vector<Value *> %s;" % indexVectorName)
+        zero = ctx.getConstant("getImm(0)")
+        indexName = ctx.getConstant("getImm(%d)" % index)
+        ctx.emitter.appendLine("%s.push_back(%s);" % (indexVectorName, zero))
+        ctx.emitter.appendLine("%s.push_back(%s);" % (indexVectorName, indexName))
+        fieldPointerName = "%s_%s_%d" % (self.getFullName(), name, ctx.temp.getTempId())
+        ctx.emitter.appendLine("Value *%s = builder->CreateGEP(%s, %s);" % (fieldPointerName, structPointer, indexVectorName))
         return TranslationResult(PointerType(fieldType), fieldPointerName)
 
 class UnionType(StructUnionBaseType):
     structUnion = "union"
-    def getIRType(self):
-        fullType = self.getFullType()
-        unionTypeName = "%s_%d" % (self.getFullName(), Temp.getTempId())
-        if fullType.irTypeName == None:
-            fullType.irTypeName = unionTypeName
-        CodeEmitter.appendLine("StructType *%s = module->getTypeByName(\"%s\");" % (unionTypeName, fullType.irTypeName))
-        CodeEmitter.appendLine("if(!%s){" % unionTypeName);
-        fieldTypeVectorName = "fieldTypeVector_%d" % Temp.getTempId()
-        CodeEmitter.appendLine("std::vector<Type *> %s;" % fieldTypeVectorName)
+    def getIRType(self, ctx):
+        fullType = self.getFullType(ctx)
+        unionTypeName = "%s_%d" % (self.getFullName(), ctx.temp.getTempId())
+        irTypeName = ctx.structIRTypeNames.setdefault(fullType, unionTypeName)
+        ctx.emitter.appendLine("StructType *%s = module->getTypeByName(\"%s\");" % (unionTypeName, irTypeName))
+        ctx.emitter.appendLine("if(!%s){" % unionTypeName);
+        fieldTypeVectorName = "fieldTypeVector_%d" % ctx.temp.getTempId()
+        ctx.emitter.appendLine("std::vector<Type *> %s;" % fieldTypeVectorName)
         greatestFieldSize = 0
         greatestFieldType = None
         for field in fullType.definition:
             assert isinstance(field, VariableDeclarator)
             fieldType = field.variable.type
-            if fieldType.getBytes() > greatestFieldSize:
+            if fieldType.getBytes(ctx) > greatestFieldSize:
                 greatestFieldSize = fieldType.getBytes
                 greatestFieldType = fieldType
         assert greatestFieldType != None
-        greatestFieldTypeName = greatestFieldType.getIRType()
-        CodeEmitter.appendLine("%s.push_back(%s);" % (fieldTypeVectorName, greatestFieldTypeName))
-        CodeEmitter.appendLine("%s = StructType::create(%s, \"%s\");" % (unionTypeName, fieldTypeVectorName, fullType.irTypeName))
-        CodeEmitter.appendLine("}");
+        greatestFieldTypeName = greatestFieldType.getIRType(ctx)
+        ctx.emitter.appendLine("%s.push_back(%s);" % (fieldTypeVectorName, greatestFieldTypeName))
+        ctx.emitter.appendLine("%s = StructType::create(%s, \"%s\");" % (unionTypeName, fieldTypeVectorName, irTypeName))
+        ctx.emitter.appendLine("}");
         return greatestFieldTypeName
-    def getFieldPointerByName(self, name, unionPointer):
-        fullType = self.getFullType()
+    def getFieldPointerByName(self, ctx, name, unionPointer):
+        fullType = self.getFullType(ctx)
         fieldType = None
         for field in fullType.definition:
             assert isinstance(field, VariableDeclarator)
@@ -779,92 +876,195 @@ class UnionType(StructUnionBaseType):
                 break
         else:
             raise UnhandledTranslationError
-        fieldTypeName = fieldType.getIRType()
-        fieldPointerTypeName = Temp.getTempName()
-        CodeEmitter.appendLine("PointerType *%s = %s->getPointerTo();" % (fieldPointerTypeName, fieldTypeName))
-        fieldPointerName = "%s_%s_%d" % (self.getFullName(), name, Temp.getTempId())
-        CodeEmitter.appendLine("Value *%s = builder->CreateBitCast(%s, %s);" % (fieldPointerName, unionPointer, fieldPointerTypeName))
+        fieldPointerTypeName = PointerType(fieldType).getIRType(ctx)
+        fieldPointerName = "%s_%s_%d" % (self.getFullName(), name, ctx.temp.getTempId())
+        ctx.emitter.appendLine("Value *%s = builder->CreateBitCast(%s, %s);" % (fieldPointerName, unionPointer, fieldPointerTypeName))
         return TranslationResult(PointerType(fieldType), fieldPointerName)
 
-class Expression(object):
+# Base of the syntax tree classes. The parser records where each node
+# comes from: start and end are offsets into the snippet, line is the line
+# the node starts on. Nodes made during translation have no span.
+class Node(object):
+    __slots__ = ('start', 'end', 'line')
+    def getSpan(self):
+        'return (start, end, line), or None if the node was not parsed'
+        try:
+            return (self.start, self.end, self.line)
+        except AttributeError:
+            return None
+    def walk(self):
+        'this node and all the nodes under it'
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            yield node
+            for cls in type(node).__mro__:
+                for name in cls.__dict__.get("__slots__", ()):
+                    child = getattr(node, name, None)
+                    if isinstance(child, list):
+                        pending.extend(item for item in child if isinstance(item, Node))
+                    elif isinstance(child, Node):
+                        pending.append(child)
+
+class Expression(Node):
+    __slots__ = ()
     def __repr__(self):
         return self.__str__()
-    def setValue(self, result):
+    def setValue(self, ctx, result):
         raise UnhandledTranslationError
-    def translate(self):
+    def translate(self, ctx):
         raise UnhandledTranslationError
-    def reference(self):
+    def reference(self, ctx):
         raise UnhandledTranslationError
-    def dereference(self):
+    def dereference(self, ctx):
         raise UnhandledTranslationError
 
 class Variable(Expression):
+    __slots__ = ('name', 'type')
     def __init__(self, name, type=None):
         self.name = name
         self.type = type
     def __str__(self):
         return self.name
-    def setValue(self, result):
-        v = variableTable.get(self.name)
+    def setValue(self, ctx, result):
+        v = ctx.variableTable.get(self.name)
         if v != None:
-            v.setValue(result)
+            v.setValue(ctx, result)
         else:
             raise UnhandledTranslationError
-    def getPointer(self):
-        v = variableTable.get(self.name)
+    def getPointer(self, ctx):
+        v = ctx.variableTable.get(self.name)
         if v != None:
-            return v.getPointer()
+            return v.getPointer(ctx)
         else:
             raise UnhandledTranslationError
-    def translate(self):
-        v = variableTable.get(self.name)
+    def translate(self, ctx):
+        v = ctx.variableTable.get(self.name)
         # if cannot find the variable from variableTable, treat it as immediate
         if v != None:
-            return v.translate()
+            return v.translate(ctx)
         else:
-            CodeEmitter.appendLine("/* Cannot find %s, treat it as immediate. */" % self.name)
+            ctx.emitter.appendLine("/* Cannot find %s, treat it as immediate. */" % self.name)
             v = IntConstantVariable(self.name, IntType(True, 64))
-            return v.translate()
+            return v.translate(ctx)
 
 class Operand(Variable):
-    def setValue(self, result):
-        newResult = TypeCaster.castTo(self.type, result)
-        CodeEmitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, self.name))
-    def getPointer(self):
+    __slots__ = ()
+    def setValue(self, ctx, result):
+        newResult = TypeCaster.castTo(ctx, self.type, result)
+        ctx.emitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, self.name))
+    def getPointer(self, ctx):
         return TranslationResult(PointerType(self.type), self.name)
-    def translate(self):
-        value = "%s_%d" % (self.name, Temp.getTempId())
-        CodeEmitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (value, self.name, value))
+    def translate(self, ctx):
+        value = "%s_%d" % (self.name, ctx.temp.getTempId())
+        ctx.emitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (value, self.name, value))
         return TranslationResult(self.type, value)
 
 class IntConstantVariable(Variable):
-    def translate(self):
-        value = "%s_%d" % (self.name, Temp.getTempId())
-        CodeEmitter.appendLine("Value *%s = getImm%d(%s);" % (value, self.type.size, self.name))
-        return TranslationResult(self.type, value)
-    def getPointer(self):
+    __slots__ = ()
+    def translate(self, ctx):
+        return TranslationResult(self.type, ctx.getImm(self.type.size, self.name))
+    def getPointer(self, ctx):
         raise UnhandledTranslationError
-    def setValue(self):
+    def setValue(self, ctx, result):
         raise UnhandledTranslationError
 
 class NormalVariable(Variable):
+    __slots__ = ('allocaValue',)
     def __init__(self, name, type, allocaValue):
         self.name = name
         self.type = type
         self.allocaValue = allocaValue
-    def setValue(self, result):
+    def setValue(self, ctx, result):
         assert self.allocaValue != None
-        newResult = TypeCaster.castTo(self.type, result)
-        CodeEmitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, self.allocaValue))
-    def getPointer(self):
+        newResult = TypeCaster.castTo(ctx, self.type, result)
+        ctx.emitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, self.allocaValue))
+    def getPointer(self, ctx):
         return TranslationResult(PointerType(self.type), self.allocaValue)
-    def translate(self):
+    def translate(self, ctx):
         assert self.allocaValue != None
-        value = "%s_%d" % (self.name, Temp.getTempId())
-        CodeEmitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (value, self.allocaValue, value))
+        value = "%s_%d" % (self.name, ctx.temp.getTempId())
+        ctx.emitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (value, self.allocaValue, value))
         return TranslationResult(self.type, value)
 
+class SSAVariable(Variable):
+    '''a scalar local whose address is never taken, in SSA mode. It has no
+    alloca; its current value is ctx.ssaValues[self].'''
+    __slots__ = ()
+    def setValue(self, ctx, result):
+        newResult = TypeCaster.castTo(ctx, self.type, result)
+        ctx.ssaValues[self] = newResult.value
+    def getPointer(self, ctx):
+        raise UnhandledTranslationError
+    def translate(self, ctx):
+        return TranslationResult(self.type, ctx.ssaValues[self])
+
+assignmentOperators = ("=", "+=", "-=", "*=", "/=", "%=", "<<=", ">>=", "&=", "|=", "^=")
+
+def assignedNames(node):
+    'the names of the variables assigned anywhere in node'
+    names = set()
+    for child in node.walk():
+        if isinstance(child, BinaryOperandExpression):
+            if child.operator in assignmentOperators and isinstance(child.left, Variable):
+                names.add(child.left.name)
+        elif isinstance(child, UnaryOperandExpression):
+            if child.operator in ("++", "--") and isinstance(child.operand, Variable):
+                names.add(child.operand.name)
+    return names
+
+# The right operand of && and || and the parts of ?: are only evaluated
+# when the condition asks for them. When they are cheap and evaluating
+# them cannot have side effects or fault, they are evaluated anyway and
+# combined with And, Or or Select, instead of branching around them.
+maxSpeculatedCost = 16
+speculatableFunctions = ("bits",)
+
+def sextWidth(functionName):
+    'N for the sign extension sext_N (sext<N> in the source), or None'
+    if functionName.startswith("sext_") and functionName[5:].isdigit():
+        width = int(functionName[5:])
+        if 0 < width <= 64:
+            return width
+    return None
+
+def speculationCost(node):
+    'the number of nodes of an expression that may be evaluated unconditionally, or None'
+    cost = 0
+    for child in node.walk():
+        if isinstance(child, BinaryOperandExpression):
+            # a division may trap
+            if child.operator in assignmentOperators or child.operator in ("/", "%"):
+                return None
+        elif isinstance(child, UnaryOperandExpression):
+            if child.operator in ("++", "--", "*"):
+                return None
+        elif isinstance(child, FunctionCallExpression):
+            name = str(child.function)
+            if name not in speculatableFunctions and sextWidth(name) == None:
+                return None
+        elif not isinstance(child, (Variable, Constant, CastExpression, ConditionalExpression,
+                                    InstanceFieldAccessExpression)):
+            # dereferences, commas, ...
+            return None
+        cost += 1
+    return cost
+
+def isSpeculatable(node):
+    cost = speculationCost(node)
+    return cost != None and cost <= maxSpeculatedCost
+
+def addressTakenNames(node):
+    'the names of the variables whose address is taken anywhere in node'
+    names = set()
+    for child in node.walk():
+        if isinstance(child, UnaryOperandExpression):
+            if child.operator == "&" and isinstance(child.operand, Variable):
+                names.add(child.operand.name)
+    return names
+
 class BinaryOperandExpression(Expression):
+    __slots__ = ('left', 'right', 'operator')
     def __init__(self, left, operator, right):
         self.left = left
         self.right = right
@@ -873,11 +1073,11 @@ class BinaryOperandExpression(Expression):
         return "(%s %s %s)" % (str(self.left), self.operator, str(self.right))
 
     # for '+' '-' '*' '/' '%'
-    def _translateHelper1(self, opType, intSignSensitive=False):
-        leftResult = self.left.translate()
-        rightResult = self.right.translate()
-        newLeftResult, newRightResult = TypeCaster.castForArithmetic(leftResult, rightResult)
-        resultName = Temp.getTempName()
+    def _translateHelper1(self, ctx, opType, intSignSensitive=False):
+        leftResult = self.left.translate(ctx)
+        rightResult = self.right.translate(ctx)
+        newLeftResult, newRightResult = TypeCaster.castForArithmetic(ctx, leftResult, rightResult)
+        resultName = ctx.temp.getTempName()
         operandType = newLeftResult.type
         if isinstance(operandType, IntType):
             if intSignSensitive:
@@ -891,26 +1091,26 @@ class BinaryOperandExpression(Expression):
             function = "CreateF%s" % opType
         else:
             raise UnhandledTranslationError
-        CodeEmitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, newLeftResult.value, newRightResult.value))
+        ctx.emitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, newLeftResult.value, newRightResult.value))
         return TranslationResult(operandType, resultName)
     # for '|' '&' '^'
-    def _translateHelper2(self, opType):
-        leftResult = self.left.translate()
-        rightResult = self.right.translate()
+    def _translateHelper2(self, ctx, opType):
+        leftResult = self.left.translate(ctx)
+        rightResult = self.right.translate(ctx)
         assert isinstance(leftResult.type, IntType)
         assert isinstance(rightResult.type, IntType)
-        newLeftResult, newRightResult = TypeCaster.castForArithmetic(leftResult, rightResult)
-        resultName = Temp.getTempName()
+        newLeftResult, newRightResult = TypeCaster.castForArithmetic(ctx, leftResult, rightResult)
+        resultName = ctx.temp.getTempName()
         operandType = newLeftResult.type
         function = "Create%s" % opType
-        CodeEmitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, newLeftResult.value, newRightResult.value))
+        ctx.emitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, newLeftResult.value, newRightResult.value))
         return TranslationResult(operandType, resultName)
     # for '<' '>' '<=' '>=' '==' '!='
-    def _translateHelper3(self, opType, intSignSensitive=True, floatOrder=True):
-        leftResult = self.left.translate()
-        rightResult = self.right.translate()
-        newLeftResult, newRightResult = TypeCaster.castForArithmetic(leftResult, rightResult)
-        resultName = Temp.getTempName()
+    def _translateHelper3(self, ctx, opType, intSignSensitive=True, floatOrder=True):
+        leftResult = self.left.translate(ctx)
+        rightResult = self.right.translate(ctx)
+        newLeftResult, newRightResult = TypeCaster.castForArithmetic(ctx, leftResult, rightResult)
+        resultName = ctx.temp.getTempName()
         operandType = newLeftResult.type
         if isinstance(operandType, IntType):
             if intSignSensitive:
@@ -927,57 +1127,70 @@ class BinaryOperandExpression(Expression):
                 function = "CreateFCmpU%s" % opType
         else:
             raise UnhandledTranslationError
-        CodeEmitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, newLeftResult.value, newRightResult.value))
+        ctx.emitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, newLeftResult.value, newRightResult.value))
         return TranslationResult(IntType(isSigned=False, size=1), resultName)
+    # the right operand of '||' '&&', evaluated without a branch
+    def _translateBool(self, ctx, operand):
+        result = operand.translate(ctx)
+        if not isinstance(result.type, IntType):
+            result = TypeCaster.castTo(ctx, IntType(), result)
+        boolValue = ctx.temp.getTempName()
+        ctx.emitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" %
+            (boolValue, result.value, ctx.getImm(result.type.size, 0)))
+        return boolValue
     # for '<<' '>>'
-    def _translateHelper4(self, opType):
-        leftResult = self.left.translate()
-        rightResult = self.right.translate()
+    def _translateHelper4(self, ctx, opType):
+        leftResult = self.left.translate(ctx)
+        rightResult = self.right.translate(ctx)
         assert isinstance(leftResult.type, IntType)
         assert isinstance(rightResult.type, IntType)
-        newRightResult = TypeCaster.castTo(leftResult.type, rightResult)
-        resultName = Temp.getTempName()
+        newRightResult = TypeCaster.castTo(ctx, leftResult.type, rightResult)
+        resultName = ctx.temp.getTempName()
         operandType = leftResult.type
         function = "Create%s" % opType
-        CodeEmitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, leftResult.value, newRightResult.value))
+        ctx.emitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, leftResult.value, newRightResult.value))
         return TranslationResult(operandType, resultName)
-    def translate(self):
-        CodeEmitter.appendLine("/* %s */" % str(self))
+    def translate(self, ctx):
+        ctx.emitComment(self)
         if self.operator == "=":
-            rightResult = self.right.translate()
-            self.left.setValue(rightResult)
+            rightResult = self.right.translate(ctx)
+            self.left.setValue(ctx, rightResult)
             return rightResult
         elif self.operator == "+":
-            return self._translateHelper1("Add")
+            return self._translateHelper1(ctx, "Add")
         elif self.operator == "-":
-            return self._translateHelper1("Sub")
+            return self._translateHelper1(ctx, "Sub")
         elif self.operator == "*":
-            return self._translateHelper1("Mul")
+            return self._translateHelper1(ctx, "Mul")
         elif self.operator == "/":
-            return self._translateHelper1("Div", intSignSensitive=True)
+            return self._translateHelper1(ctx, "Div", intSignSensitive=True)
         elif self.operator == "%":
-            return self._translateHelper1("Rem", intSignSensitive=True)
+            return self._translateHelper1(ctx, "Rem", intSignSensitive=True)
         elif self.operator == "|":
-            return self._translateHelper2("Or")
+            return self._translateHelper2(ctx, "Or")
         elif self.operator == "&":
-            return self._translateHelper2("And")
+            return self._translateHelper2(ctx, "And")
         elif self.operator == "^":
-            return self._translateHelper2("Xor")
+            return self._translateHelper2(ctx, "Xor")
         elif self.operator == "<<":
-            return self._translateHelper4("Shl")
+            return self._translateHelper4(ctx, "Shl")
         elif self.operator == ">>":
-            return self._translateHelper4("LShr")
+            return self._translateHelper4(ctx, "LShr")
         elif self.operator == "||":
-            resultName = Temp.getTempName()
-            leftResult = self.left.translate()
+            resultName = ctx.temp.getTempName()
+            leftResult = self.left.translate(ctx)
             if not isinstance(leftResult.type, IntType):
-                leftResult = TypeCaster.castTo(IntType(), leftResult)
-            zero = "zero_%d" % Temp.getTempId()
-            CodeEmitter.appendLine("Value *%s = getImm%d(0);" % (zero, leftResult.type.size))
-            leftBoolValue = Temp.getTempName()
-            CodeEmitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" % (leftBoolValue, leftResult.value, zero))
+                leftResult = TypeCaster.castTo(ctx, IntType(), leftResult)
+            zero = ctx.getImm(leftResult.type.size, 0)
+            leftBoolValue = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" % (leftBoolValue, leftResult.value, zero))
+            resultType = IntType(isSigned=False, size=1)
+            if isSpeculatable(self.right):
+                rightBoolValue = self._translateBool(ctx, self.right)
+                ctx.emitter.appendLine("Value *%s = builder->CreateOr(%s, %s);" % (resultName, leftBoolValue, rightBoolValue))
+                return TranslationResult(resultType, resultName)
 
-            branch = BranchGenerator(leftBoolValue)
+            branch = BranchGenerator(ctx, leftBoolValue)
             branch.startCondition()
             branch.endCondition()
 
@@ -985,94 +1198,97 @@ class BinaryOperandExpression(Expression):
             branch.endTruePart()
 
             branch.startFalsePart()
-            rightResult = self.right.translate()
+            rightResult = self.right.translate(ctx)
             if not isinstance(rightResult.type, IntType):
-                rightResult = TypeCaster.castTo(IntType(), rightResult)
-            rightBoolValue = Temp.getTempName()
-            CodeEmitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" % (rightBoolValue, rightResult.value, zero))
+                rightResult = TypeCaster.castTo(ctx, IntType(), rightResult)
+            rightBoolValue = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" % (rightBoolValue, rightResult.value, zero))
             branch.endFalsePart()
 
             branch.startExitPart()
-            resultType = IntType(isSigned=False, size=1)
-            branch.addPhi(resultName, resultType.getIRType(), leftBoolValue, rightBoolValue)
+            branch.addPhi(resultName, resultType.getIRType(ctx), leftBoolValue, rightBoolValue)
             branch.endExitPart()
             return TranslationResult(resultType, resultName)
         elif self.operator == "&&":
-            resultName = Temp.getTempName()
-            leftResult = self.left.translate()
+            resultName = ctx.temp.getTempName()
+            leftResult = self.left.translate(ctx)
             if not isinstance(leftResult.type, IntType):
-                leftResult = TypeCaster.castTo(IntType(), leftResult)
-            zero = "zero_%d" % Temp.getTempId()
-            CodeEmitter.appendLine("Value *%s = getImm%d(0);" % (zero, leftResult.type.size))
-            leftBoolValue = Temp.getTempName()
-            CodeEmitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" % (leftBoolValue, leftResult.value, zero))
+                leftResult = TypeCaster.castTo(ctx, IntType(), leftResult)
+            zero = ctx.getImm(leftResult.type.size, 0)
+            leftBoolValue = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" % (leftBoolValue, leftResult.value, zero))
+            resultType = IntType(isSigned=False, size=1)
+            if isSpeculatable(self.right):
+                rightBoolValue = self._translateBool(ctx, self.right)
+                ctx.emitter.appendLine("Value *%s = builder->CreateAnd(%s, %s);" % (resultName, leftBoolValue, rightBoolValue))
+                return TranslationResult(resultType, resultName)
 
-            branch = BranchGenerator(leftBoolValue)
+            branch = BranchGenerator(ctx, leftBoolValue)
             branch.startCondition()
             branch.endCondition()
 
             branch.startTruePart()
-            rightResult = self.right.translate()
+            rightResult = self.right.translate(ctx)
             if not isinstance(rightResult.type, IntType):
-                rightResult = TypeCaster.castTo(IntType(), rightResult)
-            rightBoolValue = Temp.getTempName()
-            CodeEmitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" % (rightBoolValue, rightResult.value, zero))
+                rightResult = TypeCaster.castTo(ctx, IntType(), rightResult)
+            rightBoolValue = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateICmpNE(%s, %s);" % (rightBoolValue, rightResult.value, zero))
             branch.endTruePart()
 
             branch.startFalsePart()
             branch.endFalsePart()
 
             branch.startExitPart()
-            resultType = IntType(isSigned=False, size=1)
-            branch.addPhi(resultName, resultType.getIRType(), rightBoolValue, leftBoolValue)
+            branch.addPhi(resultName, resultType.getIRType(ctx), rightBoolValue, leftBoolValue)
             branch.endExitPart()
             return TranslationResult(resultType, resultName)
         elif self.operator == "<":
-            return self._translateHelper3("LT")
+            return self._translateHelper3(ctx, "LT")
         elif self.operator == ">":
-            return self._translateHelper3("GT")
+            return self._translateHelper3(ctx, "GT")
         elif self.operator == "<=":
-            return self._translateHelper3("LE")
+            return self._translateHelper3(ctx, "LE")
         elif self.operator == ">=":
-            return self._translateHelper3("GE")
+            return self._translateHelper3(ctx, "GE")
         elif self.operator == "==":
-            return self._translateHelper3("EQ", intSignSensitive=False)
+            return self._translateHelper3(ctx, "EQ", intSignSensitive=False)
         elif self.operator == "!=":
-            return self._translateHelper3("NE", intSignSensitive=False)
+            return self._translateHelper3(ctx, "NE", intSignSensitive=False)
         elif self.operator == "+=":
-            result = self._translateHelper1("Add")
-            self.left.setValue(result)
+            result = self._translateHelper1(ctx, "Add")
+            self.left.setValue(ctx, result)
         elif self.operator == "-=":
-            result = self._translateHelper1("Sub")
-            self.left.setValue(result)
+            result = self._translateHelper1(ctx, "Sub")
+            self.left.setValue(ctx, result)
         elif self.operator == "*=":
-            result = self._translateHelper1("Mul")
-            self.left.setValue(result)
+            result = self._translateHelper1(ctx, "Mul")
+            self.left.setValue(ctx, result)
         elif self.operator == "/=":
-            result = self._translateHelper1("Div", intSignSensitive=True)
-            self.left.setValue(result)
+            result = self._translateHelper1(ctx, "Div", intSignSensitive=True)
+            self.left.setValue(ctx, result)
         elif self.operator == "%=":
-            result = self._translateHelper1("Rem", intSignSensitive=True)
-            self.left.setValue(result)
+            result = self._translateHelper1(ctx, "Rem", intSignSensitive=True)
+            self.left.setValue(ctx, result)
         elif self.operator == "<<=":
-            result = self._translateHelper4("Shl")
-            self.left.setValue(result)
+            result = self._translateHelper4(ctx, "Shl")
+            self.left.setValue(ctx, result)
         elif self.operator == ">>=":
-            result = self._translateHelper4("LShr")
-            self.left.setValue(result)
+            result = self._translateHelper4(ctx, "LShr")
+            self.left.setValue(ctx, result)
         elif self.operator == "&=":
-            result = self._translateHelper2("And")
-            self.left.setValue(result)
+            result = self._translateHelper2(ctx, "And")
+            self.left.setValue(ctx, result)
         elif self.operator == "|=":
-            result = self._translateHelper2("Or")
-            self.left.setValue(result)
+            result = self._translateHelper2(ctx, "Or")
+            self.left.setValue(ctx, result)
         elif self.operator == "^=":
-            result = self._translateHelper2("Xor")
-            self.left.setValue(result)
+            result = self._translateHelper2(ctx, "Xor")
+            self.left.setValue(ctx, result)
         else:
             raise UnhandledTranslationError
 
 class UnaryOperandExpression(Expression):
+    __slots__ = ('operand', 'operator', 'isPrefix')
     def __init__(self, operand, operator, isPrefix):
         self.operand = operand
         self.operator = operator
@@ -1088,148 +1304,165 @@ class UnaryOperandExpression(Expression):
         s += ")"
         return s
     # for '-'
-    def _translateNeg(self):
-        operandResult = self.operand.translate()
+    def _translateNeg(self, ctx):
+        operandResult = self.operand.translate(ctx)
         operandType = operandResult.type
-        resultName = Temp.getTempName()
+        resultName = ctx.temp.getTempName()
         if isinstance(operandType, IntType):
             function = "CreateNeg"
         elif isinstance(operandType, FloatType) or isinstance(operandType, DoubleType):
             function = "CreateFNeg"
         else:
             raise UnhandledTranslationError
-        CodeEmitter.appendLine("Value *%s = builder->%s(%s);" % (resultName, function, operandResult.value))
+        ctx.emitter.appendLine("Value *%s = builder->%s(%s);" % (resultName, function, operandResult.value))
         return TranslationResult(operandType, resultName)
 
-    def _translateNot(self):
-        operandResult = self.operand.translate()
+    def _translateNot(self, ctx):
+        operandResult = self.operand.translate(ctx)
         operandType = operandResult.type
         assert isinstance(operandType, IntType)
-        resultName = Temp.getTempName()
-        allOne = "allone_%d" % Temp.getTempId()
-        typeName = operandType.getIRType()
-        CodeEmitter.appendLine("Value *%s = Constant::getAllOnesValue(%s);" % (allOne, typeName))
+        resultName = ctx.temp.getTempName()
+        allOne = ctx.getConstant("Constant::getAllOnesValue(%s)" % operandType.getIRType(ctx))
         function = "CreateXor"
-        CodeEmitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, operandResult.value, allOne))
+        ctx.emitter.appendLine("Value *%s = builder->%s(%s, %s);" %(resultName, function, operandResult.value, allOne))
         return TranslationResult(operandType, resultName)
 
-    def _translateLNot(self):
-        operandResult = self.operand.translate()
+    def _translateLNot(self, ctx):
+        operandResult = self.operand.translate(ctx)
         operandType = operandResult.type
-        resultName = Temp.getTempName()
-        zero = "zero_%d" % Temp.getTempId()
+        resultName = ctx.temp.getTempName()
         if isinstance(operandType, IntType):
             function = "CreateICmpEQ"
-            CodeEmitter.appendLine("Value *%s = getImm%s(0);" % (zero, operandType.size))
+            zero = ctx.getImm(operandType.size, 0)
         elif isinstance(operandType, FloatType) or isinstance(operandType, DoubleType):
             function = "CreateFCmpEQ"
-            CodeEmitter.appendLine("Value *%s = translator::getFp(0.0);" % zero)
+            zero = ctx.getConstant("translator::getFp(0.0)")
         else:
             raise UnhandledTranslationError
-        CodeEmitter.appendLine("Value *%s = builder->%s(%s, %s);" % (resultName, function, operandResult.value, zero))
+        ctx.emitter.appendLine("Value *%s = builder->%s(%s, %s);" % (resultName, function, operandResult.value, zero))
         return TranslationResult(IntType(size=1, isSigned=False), resultName)
     # for '++', '--'
-    def _translateHelper(self, opType):
-        operandResult = self.operand.translate()
+    def _translateHelper(self, ctx, opType):
+        operandResult = self.operand.translate(ctx)
         operandType = operandResult.type
-        one = "one_%d" % Temp.getTempId()
-        resultName = Temp.getTempName()
+        resultName = ctx.temp.getTempName()
         if isinstance(operandType, IntType):
             function = "Create%s" % opType
-            CodeEmitter.appendLine("Value *%s = getImm%d(1);" % (one, operandType.size))
+            one = ctx.getImm(operandType.size, 1)
         elif isinstance(operandType, FloatType) or isinstance(operandType, DoubleType):
             function = "CreateF%s" % opType
-            CodeEmitter.appendLine("Value *%s = translator::getFp(1.0);" % (one))
+            one = ctx.getConstant("translator::getFp(1.0)")
         else:
             raise UnhandledTranslationError
-        CodeEmitter.appendLine("Value *%s = builder->%s(%s, %s);" % (resultName, function, operandResult.value, one))
+        ctx.emitter.appendLine("Value *%s = builder->%s(%s, %s);" % (resultName, function, operandResult.value, one))
         result = TranslationResult(operandType, resultName)
-        self.operand.setValue(result)
+        self.operand.setValue(ctx, result)
         if self.isPrefix:
             return result
         else:
             return operandResult
-    def translate(self):
-        CodeEmitter.appendLine("/* %s */" % str(self))
+    def translate(self, ctx):
+        ctx.emitComment(self)
         if self.operator == "-":
-            return self._translateNeg()
+            return self._translateNeg(ctx)
         elif self.operator == "+":
-            return self.operand.translate()
+            return self.operand.translate(ctx)
         elif self.operator == '~':
-            return self._translateNot()
+            return self._translateNot(ctx)
         elif self.operator == "!":
-            return self._translateLNot()
+            return self._translateLNot(ctx)
         elif self.operator == "++":
-            return self._translateHelper("Add")
+            return self._translateHelper(ctx, "Add")
         elif self.operator == "--":
-            return self._translateHelper("Sub")
+            return self._translateHelper(ctx, "Sub")
         elif self.operator == "&":
-            return self.operand.getPointer()
+            return self.operand.getPointer(ctx)
         elif self.operator == "*":
-            operandResult = self.operand.translate()
+            operandResult = self.operand.translate(ctx)
             assert isinstance(operandResult.type, PointerType)
             resultType = operandResult.type.baseType
-            resultName = Temp.getTempName()
-            CodeEmitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (resultName, operandResult.value, resultName))
+            resultName = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (resultName, operandResult.value, resultName))
             return TranslationResult(resultType, resultName)
         else:
             raise UnhandledTranslationError
 
 class CastExpression(Expression):
+    __slots__ = ('targetType', 'originalExpression')
     def __init__(self, targetType, originalExpression):
-        if isinstance(targetType, TypeIDType):
-            targetType = targetType.getActualType()
         self.targetType = targetType
         self.originalExpression = originalExpression
     def __str__(self):
         return "(%s)(%s)" % (str(self.targetType), str(self.originalExpression))
-    def translate(self):
-        originalResult = self.originalExpression.translate()
-        return TypeCaster.castTo(self.targetType, originalResult)
+    def translate(self, ctx):
+        targetType = self.targetType
+        if isinstance(targetType, TypeIDType):
+            targetType = targetType.getActualType(ctx)
+        originalResult = self.originalExpression.translate(ctx)
+        return TypeCaster.castTo(ctx, targetType, originalResult)
 
 class ConditionalExpression(Expression):
+    __slots__ = ('condition', 'truePart', 'falsePart')
     def __init__(self, condition, truePart, falsePart):
         self.condition = condition
         self.truePart = truePart
         self.falsePart = falsePart
     def __str__(self):
         return "(%s)?(%s):(%s)" % (str(self.condition), str(self.truePart), str(self.falsePart))
-    def translate(self):
-        branch = BranchGenerator(mayAppend=True)
+    def translate(self, ctx):
+        if isSpeculatable(self.truePart) and isSpeculatable(self.falsePart):
+            return self._translateSelect(ctx)
+        branch = BranchGenerator(ctx, mayAppend=True)
         branch.startCondition()
-        condResult = self.condition.translate()
-        condResult = TypeCaster.castTo(IntType(False, 1), condResult)
+        condResult = self.condition.translate(ctx)
+        condResult = TypeCaster.castTo(ctx, IntType(False, 1), condResult)
         branch.setCondName(condResult.value)
         branch.endCondition()
 
         branch.startTruePart()
-        trueResult = self.truePart.translate()
+        trueResult = self.truePart.translate(ctx)
         branch.endTruePart()
 
         branch.startFalsePart()
-        falseResult = self.falsePart.translate()
+        falseResult = self.falsePart.translate(ctx)
         branch.endFalsePart()
 
-        compareResult = trueResult.type.compare(falseResult.type)
+        compareResult = trueResult.type.compare(ctx, falseResult.type)
         if compareResult == TypeCompareResult.EQ:
             pass
         elif compareResult == TypeCompareResult.LT:
             branch.startAppendToTruePart()
-            trueResult = TypeCaster.castTo(falseResult.type, trueResult)
+            trueResult = TypeCaster.castTo(ctx, falseResult.type, trueResult)
             branch.endAppendToTruePart()
         elif compareResult == TypeCompareResult.GT:
             branch.startAppendToFalsePart()
-            falseResult = TypeCaster.castTo(trueResult.type, falseResult)
+            falseResult = TypeCaster.castTo(ctx, trueResult.type, falseResult)
             branch.endAppendToFalsePart()
         else:
             raise UnhandledTranslationError
 
         branch.startExitPart()
-        resultName = Temp.getTempName()
+        resultName = ctx.temp.getTempName()
         resultType = trueResult.type
-        resultIRType = resultType.getIRType()
+        resultIRType = resultType.getIRType(ctx)
         branch.addPhi(resultName, resultIRType, trueResult.value, falseResult.value)
         return TranslationResult(resultType, resultName)
+    def _translateSelect(self, ctx):
+        condResult = self.condition.translate(ctx)
+        condResult = TypeCaster.castTo(ctx, IntType(False, 1), condResult)
+        trueResult = self.truePart.translate(ctx)
+        falseResult = self.falsePart.translate(ctx)
+        compareResult = trueResult.type.compare(ctx, falseResult.type)
+        if compareResult == TypeCompareResult.LT:
+            trueResult = TypeCaster.castTo(ctx, falseResult.type, trueResult)
+        elif compareResult == TypeCompareResult.GT:
+            falseResult = TypeCaster.castTo(ctx, trueResult.type, falseResult)
+        elif compareResult != TypeCompareResult.EQ:
+            raise UnhandledTranslationError
+        resultName = ctx.temp.getTempName()
+        ctx.emitter.appendLine("Value *%s = builder->CreateSelect(%s, %s, %s);" %
+            (resultName, condResult.value, trueResult.value, falseResult.value))
+        return TranslationResult(trueResult.type, resultName)
 
 functions = {
     "testcond":(
@@ -1242,76 +1475,291 @@ functions = {
         )
 }
 
+# The condition flags of the semantics: findX(width, result, src1, src2)
+# is the flag X of result = src1 + src2 (+ carry), computed from the three
+# values the way the Translator::findX runtime helpers compute it.
+flagFunctions = ("findCarry", "findOverflow", "findNegative", "findZero")
+
+def flagAssignment(statement):
+    '''the flag and the call of a statement "flag = findX(width, ...) & 1"
+    whose arguments may be evaluated once for several flags, or None'''
+    if not isinstance(statement, ExpressionStatement):
+        return None
+    assignment = statement.expression
+    if not isinstance(assignment, BinaryOperandExpression) or assignment.operator != "=" or \
+            type(assignment.left) != Variable:
+        return None
+    call = assignment.right
+    if isinstance(call, BinaryOperandExpression) and call.operator == "&" and \
+            constfold.constantValue(call.right) != None and constfold.constantValue(call.right)[1] == 1:
+        call = call.left
+    if not isinstance(call, FunctionCallExpression) or str(call.function) not in flagFunctions:
+        return None
+    if len(call.arguments) < 2 or constfold.constantValue(call.arguments[0]) == None:
+        return None
+    for argument in call.arguments[1:]:
+        if not isSpeculatable(argument):
+            return None
+    return assignment.left.name, call
+
+def flagRunLength(statements, start):
+    '''the number of statements from start on that set flags, none of which
+    changes a variable the calls read'''
+    flags = set()
+    names = set()
+    count = 0
+    for statement in statements[start:]:
+        found = flagAssignment(statement)
+        if found == None:
+            break
+        flag, call = found
+        callNames = set(child.name for argument in call.arguments[1:]
+                        for child in argument.walk() if isinstance(child, Variable))
+        if flag in names or flag in callNames or callNames & flags:
+            break
+        flags.add(flag)
+        names |= callNames
+        count += 1
+    return count
+
+class FlagComputation(object):
+    '''the flags of the findX calls of a run of statements (see
+    CompoundStatement.translate). Each argument is translated once, for the
+    first call reading it, and each term of the flag formulas is emitted
+    once, so the flags of one result share their loads and their Xor.'''
+    def __init__(self):
+        # result of every argument and handle of every term, by key
+        self.arguments = {}
+        self.terms = {}
+    def argument(self, ctx, argument, width):
+        key = (str(argument), width)
+        result = self.arguments.get(key)
+        if result == None:
+            result = argument.translate(ctx)
+            # fix bug for immediate numbers
+            if result.type.size != width:
+                result = TypeCaster.castTo(ctx, IntType(True, width), result)
+            self.arguments[key] = result
+        return result.value
+    def term(self, ctx, function, *operands):
+        key = (function,) + operands
+        name = self.terms.get(key)
+        if name == None:
+            name = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->%s(%s);" % (name, function, ", ".join(operands)))
+            self.terms[key] = name
+        return name
+    def flag(self, ctx, functionName, width, arguments):
+        'the handle of the i1 flag of findX(width, arguments)'
+        values = [self.argument(ctx, argument, width) for argument in arguments]
+        zero = ctx.getImm(width, 0)
+        result = values[0]
+        if functionName == "findNegative":
+            return self.term(ctx, "CreateICmpSLT", result, zero)
+        elif functionName == "findZero":
+            return self.term(ctx, "CreateICmpEQ", result, zero)
+        src1, src2 = values[1], values[2]
+        differ = self.term(ctx, "CreateXor", src1, src2)
+        if functionName == "findCarry":
+            # the top bits of src1 and src2 are both set, or one of them is
+            # and the one of result is clear
+            carry = self.term(ctx, "CreateAnd", differ, self.term(ctx, "CreateNot", result))
+            carry = self.term(ctx, "CreateOr", self.term(ctx, "CreateAnd", src1, src2), carry)
+            return self.term(ctx, "CreateICmpSLT", carry, zero)
+        # src1 and src2 have the same sign, and result another one
+        overflow = self.term(ctx, "CreateXor", src1, result)
+        overflow = self.term(ctx, "CreateAnd", self.term(ctx, "CreateNot", differ), overflow)
+        return self.term(ctx, "CreateICmpSLT", overflow, zero)
+
 class FunctionCallExpression(Expression):
+    __slots__ = ('function', 'arguments')
     def __init__(self, function, arguments):
         self.function = function #NOTE: function might be function pointer
         self.arguments = arguments
     def __str__(self):
         argumentsString = ",".join([str(argument) for argument in self.arguments])
         return "%s(%s)" %(str(self.function), argumentsString)
-    def translate(self):
-        CodeEmitter.appendLine("/* %s */" % str(self))
-        resultName = Temp.getTempName()
+    def translate(self, ctx):
+        ctx.emitComment(self)
+        resultName = ctx.temp.getTempName()
         functionName = str(self.function)
-        if functionName in ("findCarry", "findOverflow", "findNegative", "findZero"):
+        if functionName in flagFunctions:
             width = int(self.arguments[0].value)
-            argumentsResult = [ argument.translate() for argument in self.arguments[1:] ]
-            # fix bug for immediate numbers
-            def convert (result):
-                if result.type.size == width:
-                    return result
-                else:
-                    return TypeCaster.castTo(IntType(True, width), result)
-            argumentsResult = [ convert(result) for result in argumentsResult ]
-            argumentsString = ",".join([result.value for result in argumentsResult])
-            code = "Value *%s = Translator::%s(this, %d, %s);" % (resultName, functionName, width, argumentsString)
-            CodeEmitter.appendLine(code)
-            castResultName = Temp.getTempName()
-            typeName = IntType(False, 1).getIRType()
-            CodeEmitter.appendLine("Value *%s = builder->CreateIntCast(%s, %s, false);" % (castResultName, resultName, typeName))
-            return TranslationResult(IntType(False, 1), castResultName)
-        elif functionName in ('sext_8', 'sext_16', 'sext_32', 'sext_64'):
-            argumentResult = self.arguments[0].translate()
-            width = functionName.split('_')[1]
-            CodeEmitter.appendLine("Value *%s = Translator::sext(%s, %s, true);" % (resultName, argumentResult.value, width))
-            return TranslationResult(IntType(True, 64), resultName)
+            flags = ctx.flags
+            if flags == None:
+                flags = FlagComputation()
+            flagName = flags.flag(ctx, functionName, width, self.arguments[1:])
+            return TranslationResult(IntType(False, 1), flagName)
+        elif sextWidth(functionName) != None:
+            return self._translateSext(ctx, sextWidth(functionName))
         elif functionName == "bits":
-            argumentsResult = [argument.translate() for argument in self.arguments]
+            hi = constfold.constantValue(self.arguments[1])
+            lo = constfold.constantValue(self.arguments[2])
+            valueResult = self.arguments[0].translate(ctx)
+            valueType = valueResult.type
+            if isinstance(valueType, TypeIDType):
+                valueType = valueType.getActualType(ctx)
+            if hi != None and lo != None and isinstance(valueType, IntType) and \
+                    lo[1] <= hi[1] < valueType.size:
+                return self._translateBits(ctx, TranslationResult(valueType, valueResult.value), hi[1], lo[1])
+            argumentsResult = [valueResult] + [argument.translate(ctx) for argument in self.arguments[1:]]
             argumentsString = ",".join([result.value for result in argumentsResult])
-            CodeEmitter.appendLine('Value *%s = genBits(%s);' % (resultName, argumentsString))
+            ctx.emitter.appendLine('Value *%s = genBits(%s);' % (resultName, argumentsString))
             return TranslationResult(argumentsResult[0].type, resultName)
         elif functionName == "swap_byte":
-            argumentResult = self.arguments[0].translate()
-            CodeEmitter.appendLine('Value *%s = genSwap_byte(%s);' % (resultName, argumentResult.value))
+            argumentResult = self.arguments[0].translate(ctx)
+            ctx.emitter.appendLine('Value *%s = genSwap_byte(%s);' % (resultName, argumentResult.value))
             return TranslationResult(argumentResult.type, resultName)
         elif functionName in functions.keys():
             # Does not support function overloading yet
             prototype = functions[functionName]
             
             # Get function
-            irFunctionName = "%s_%d" % (functionName, Temp.getTempId())
-            CodeEmitter.appendLine('Function *%s = module->getFunction("%s");' % (irFunctionName, functionName))
-            CodeEmitter.appendLine('if(%s == NULL){' % irFunctionName);
-            irPrototype = [t.getIRType() for t in prototype]
+            irFunctionName = "%s_%d" % (functionName, ctx.temp.getTempId())
+            ctx.emitter.appendLine('Function *%s = module->getFunction("%s");' % (irFunctionName, functionName))
+            ctx.emitter.appendLine('if(%s == NULL){' % irFunctionName);
+            irPrototype = [t.getIRType(ctx) for t in prototype]
             irArguments = ",".join(irPrototype)
-            CodeEmitter.appendLine('%s=cast<Function>(module->getOrInsertFunction("%s", %s, NULL));' % (irFunctionName, functionName, irArguments))
-            CodeEmitter.appendLine('execution_engine->addGlobalMapping(%s, (void *)%s);' % (irFunctionName, functionName))
-            CodeEmitter.appendLine('}')
+            ctx.emitter.appendLine('%s=cast<Function>(module->getOrInsertFunction("%s", %s, NULL));' % (irFunctionName, functionName, irArguments))
+            ctx.emitter.appendLine('execution_engine->addGlobalMapping(%s, (void *)%s);' % (irFunctionName, functionName))
+            ctx.emitter.appendLine('}')
 
             # Prepare arguments
             argumentsVectorName = "arguments_of_" + irFunctionName
-            CodeEmitter.appendLine("std::vector<Value *> %s;" % (argumentsVectorName))
+            ctx.emitter.appendLine("std::vector<Value *> %s;" % (argumentsVectorName))
             for i in range(len(self.arguments)):
-                argumentResult = self.arguments[i].translate()
-                argumentResult = TypeCaster.castTo(prototype[i+1], argumentResult)
-                CodeEmitter.appendLine("%s.push_back(%s);" % (argumentsVectorName, argumentResult.value))
+                argumentResult = self.arguments[i].translate(ctx)
+                argumentResult = TypeCaster.castTo(ctx, prototype[i+1], argumentResult)
+                ctx.emitter.appendLine("%s.push_back(%s);" % (argumentsVectorName, argumentResult.value))
             # Call the function
-            CodeEmitter.appendLine('Value *%s = builder->CreateCall(%s, %s);' % (resultName, irFunctionName, argumentsVectorName))
+            ctx.emitter.appendLine('Value *%s = builder->CreateCall(%s, %s);' % (resultName, irFunctionName, argumentsVectorName))
             return TranslationResult(prototype[0], resultName)
         else:
             raise UnhandledTranslationError
 
+    # sext<N>(x): the low N bits of x, sign-extended to 64 bits, without a
+    # call to Translator::sext. x is converted to uint64_t as in C, so a
+    # narrower x is extended as its own type is signed.
+    def _translateSext(self, ctx, width):
+        resultType = IntType(True, 64)
+        argument = self.arguments[0]
+        if isinstance(argument, CastExpression):
+            castType = argument.targetType
+            if isinstance(castType, TypeIDType):
+                castType = castType.getActualType(ctx)
+            valueResult = argument.originalExpression.translate(ctx)
+            valueType = valueResult.type
+            if isinstance(valueType, TypeIDType):
+                valueType = valueType.getActualType(ctx)
+            # a cast that keeps the low N bits does not change the result
+            if not (type(castType) == IntType and castType.size >= width and
+                    isinstance(valueType, IntType) and valueType.size >= width):
+                valueResult = TypeCaster.castTo(ctx, castType, valueResult)
+        else:
+            valueResult = argument.translate(ctx)
+        valueType = valueResult.type
+        if isinstance(valueType, TypeIDType):
+            valueType = valueType.getActualType(ctx)
+        if not isinstance(valueType, IntType):
+            raise UnhandledTranslationError
+        size = valueType.size
+        value = valueResult.value
+        if size == 64 and valueResult.signExtendedFrom != None and valueResult.signExtendedFrom <= width:
+            # already sign-extended from bit N-1 or below
+            return TranslationResult(resultType, value, valueResult.signExtendedFrom)
+        typeName = resultType.getIRType(ctx)
+        if width > size:
+            # bit N-1 is a copy of the sign bit of x, or zero
+            resultName = ctx.temp.getTempName()
+            if valueType.isSigned:
+                ctx.emitter.appendLine("Value *%s = builder->CreateSExt(%s, %s);" % (resultName, value, typeName))
+                return TranslationResult(resultType, resultName, size)
+            ctx.emitter.appendLine("Value *%s = builder->CreateZExt(%s, %s);" % (resultName, value, typeName))
+            return TranslationResult(resultType, resultName, size + 1)
+        if width < size:
+            truncName = ctx.temp.getTempName()
+            truncTypeName = IntType(True, width).getIRType(ctx)
+            ctx.emitter.appendLine("Value *%s = builder->CreateTrunc(%s, %s);" % (truncName, value, truncTypeName))
+            value = truncName
+        elif size == 64:
+            return TranslationResult(resultType, value, width)
+        resultName = ctx.temp.getTempName()
+        ctx.emitter.appendLine("Value *%s = builder->CreateSExt(%s, %s);" % (resultName, value, typeName))
+        return TranslationResult(resultType, resultName, width)
+
+    # bits() with literal indices, without a call to genBits
+    def _translateBits(self, ctx, valueResult, hi, lo):
+        valueType = valueResult.type
+        size = valueType.size
+        value = valueResult.value
+        if lo != 0:
+            shifted = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateLShr(%s, %s);" % (shifted, value, ctx.getImm(size, lo)))
+            value = shifted
+        if hi == size - 1:
+            return TranslationResult(valueType, value)
+        resultName = ctx.temp.getTempName()
+        if lo == 0:
+            narrowName = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateTrunc(%s, %s);" %
+                (narrowName, value, IntType(False, hi + 1).getIRType(ctx)))
+            ctx.emitter.appendLine("Value *%s = builder->CreateZExt(%s, %s);" % (resultName, narrowName, valueType.getIRType(ctx)))
+        else:
+            mask = ctx.getImm(size, immediateText((1 << (hi - lo + 1)) - 1))
+            ctx.emitter.appendLine("Value *%s = builder->CreateAnd(%s, %s);" % (resultName, value, mask))
+        return TranslationResult(valueType, resultName)
+
+class LookupTableExpression(Expression):
+    '''the entry of a constant table at an index translated beforehand, for
+    the switches lowered by SwitchStatement. When inRange is set, the
+    value of fallback is taken instead if it is false.'''
+    __slots__ = ('index', 'entries', 'type', 'inRange', 'fallback')
+    def __init__(self, index, entries, type, inRange=None, fallback=None):
+        self.index = index
+        self.entries = entries
+        self.type = type
+        self.inRange = inRange
+        self.fallback = fallback
+    def __str__(self):
+        return "{%s}[%s]" % (", ".join(immediateText(bits) for bits in self.entries), self.index)
+    def translate(self, ctx):
+        irType = self.type.getIRType(ctx)
+        if len(set(self.entries)) == 1:
+            value = ctx.getImm(self.type.size, immediateText(self.entries[0]))
+        else:
+            # named after its content, so that it is made once per module
+            globalName = "lookup_table_%s" % hashlib.sha1("%s %s" % (irType, self.entries)).hexdigest()[:16]
+            tableName = "table_%d" % ctx.temp.getTempId()
+            ctx.emitter.appendLine('GlobalVariable *%s = module->getNamedGlobal("%s");' % (tableName, globalName))
+            ctx.emitter.appendLine('if(%s == NULL){' % tableName)
+            arrayTypeName = "type_of_" + tableName
+            entriesName = "entries_of_" + tableName
+            ctx.emitter.appendLine("ArrayType *%s = ArrayType::get(%s, %d);" % (arrayTypeName, irType, len(self.entries)))
+            ctx.emitter.appendLine("std::vector<Constant *> %s;" % entriesName)
+            for bits in self.entries:
+                ctx.emitter.appendLine("%s.push_back(ConstantInt::get(%s, %s));" % (entriesName, irType, immediateText(bits)))
+            ctx.emitter.appendLine('%s = new GlobalVariable(*module, %s, true, GlobalValue::PrivateLinkage, '
+                                   'ConstantArray::get(%s, %s), "%s");' %
+                                   (tableName, arrayTypeName, arrayTypeName, entriesName, globalName))
+            ctx.emitter.appendLine('}')
+            indexVectorName = "index_vector_%d" % ctx.temp.getTempId()
+            ctx.emitter.appendLine("std::vector<Value *> %s;" % indexVectorName)
+            ctx.emitter.appendLine("%s.push_back(%s);" % (indexVectorName, ctx.getConstant("getImm(0)")))
+            ctx.emitter.appendLine("%s.push_back(%s);" % (indexVectorName, self.index))
+            pointerName = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateInBoundsGEP(%s, %s);" % (pointerName, tableName, indexVectorName))
+            value = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateLoad(%s);" % (value, pointerName))
+        if self.inRange == None:
+            return TranslationResult(self.type, value)
+        fallbackResult = TypeCaster.castTo(ctx, self.type, self.fallback.translate(ctx))
+        resultName = ctx.temp.getTempName()
+        ctx.emitter.appendLine("Value *%s = builder->CreateSelect(%s, %s, %s);" %
+            (resultName, self.inRange, value, fallbackResult.value))
+        return TranslationResult(self.type, resultName)
+
 class CommaExpression(Expression):
+    __slots__ = ('expressionList',)
     def __init__(self, expressionList):
         self.expressionList = expressionList
     def __str__(self):
@@ -1323,90 +1771,95 @@ class CommaExpression(Expression):
         return s
     def append(self, expression):
         self.expressionList.append(expression)
-    def translate(self):
+    def translate(self, ctx):
         for item in self.expressionList:
-            result = item.translate()
+            result = item.translate(ctx)
         return result
 
 class InstanceFieldAccessExpression(Expression):
+    __slots__ = ('instance', 'field')
     def __init__(self, instance, field):
         self.instance = instance
         self.field = field
     def __str__(self):
         return "(%s).%s" % (str(self.instance), str(self.field))
-    def setValue(self, result):
-        fieldPointerResult = self.getPointer()
+    def setValue(self, ctx, result):
+        fieldPointerResult = self.getPointer(ctx)
         fieldType = fieldPointerResult.type.baseType
-        newResult = TypeCaster.castTo(fieldType, result)
-        CodeEmitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, fieldPointerResult.value))
-    def getPointer(self):
-        instancePointerResult = self.instance.getPointer()
+        newResult = TypeCaster.castTo(ctx, fieldType, result)
+        ctx.emitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, fieldPointerResult.value))
+    def getPointer(self, ctx):
+        instancePointerResult = self.instance.getPointer(ctx)
         instanceType = instancePointerResult.type.baseType
         assert isinstance(instanceType, StructUnionBaseType)
-        return instanceType.getFieldPointerByName(self.field.name, instancePointerResult.value)
-    def translate(self):
-        fieldPointerResult = self.getPointer()
-        resultName = Temp.getTempName()
-        CodeEmitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (resultName, fieldPointerResult.value, resultName))
+        return instanceType.getFieldPointerByName(ctx, self.field.name, instancePointerResult.value)
+    def translate(self, ctx):
+        fieldPointerResult = self.getPointer(ctx)
+        resultName = ctx.temp.getTempName()
+        ctx.emitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (resultName, fieldPointerResult.value, resultName))
         return TranslationResult(fieldPointerResult.type.baseType, resultName)
 
 class PointerFieldAccessExpression(Expression):
+    __slots__ = ('pointer', 'field')
     def __init__(self, pointer, field):
         self.pointer = pointer
         self.field = field
     def __str__(self):
         return "(%s)->%s" % (str(self.pointer), str(self.field))
-    def setValue(self, result):
-        fieldPointerResult = self.getPointer()
+    def setValue(self, ctx, result):
+        fieldPointerResult = self.getPointer(ctx)
         fieldType = fieldPointerResult.type.baseType
-        newResult = TypeCaster.castTo(fieldType, result)
-        CodeEmitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, fieldPointerResult.value))
-    def getPointer(self):
-        instancePointerResult = self.pointer.translate()
+        newResult = TypeCaster.castTo(ctx, fieldType, result)
+        ctx.emitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, fieldPointerResult.value))
+    def getPointer(self, ctx):
+        instancePointerResult = self.pointer.translate(ctx)
         instanceType = instancePointerResult.type.baseType
         assert isinstance(instanceType, StructUnionBaseType)
-        return instanceType.getFieldPointerByName(self.field.name, instancePointerResult.value)
-    def translate(self):
-        fieldPointerResult = self.getPointer()
-        resultName = Temp.getTempName()
-        CodeEmitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (resultName, fieldPointerResult.value, resultName))
+        return instanceType.getFieldPointerByName(ctx, self.field.name, instancePointerResult.value)
+    def translate(self, ctx):
+        fieldPointerResult = self.getPointer(ctx)
+        resultName = ctx.temp.getTempName()
+        ctx.emitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (resultName, fieldPointerResult.value, resultName))
         return TranslationResult(fieldPointerResult.type.baseType, resultName)
 
 class ArrayAccessExpression(Expression):
+    __slots__ = ('base', 'index')
     def __init__(self, base, index):
         self.base = base
         self.index = index
     def __str__(self):
         return "(%s)[%s]" % (str(self.base), str(self.index))
-    def setValue(self, result):
-        pointerResult = self.getPointer()
-        newResult = TypeCaster.castTo(pointerResult.type.baseType, result)
-        CodeEmitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, pointerResult.value))
-    def getPointer(self):
-        baseResult = self.base.translate()
+    def setValue(self, ctx, result):
+        pointerResult = self.getPointer(ctx)
+        newResult = TypeCaster.castTo(ctx, pointerResult.type.baseType, result)
+        ctx.emitter.appendLine("builder->CreateStore(%s, %s);" % (newResult.value, pointerResult.value))
+    def getPointer(self, ctx):
+        baseResult = self.base.translate(ctx)
         assert isinstance(baseResult.type, PointerType)
-        indexResult = self.index.translate()
+        indexResult = self.index.translate(ctx)
         if not isinstance(indexResult.type, IntType):
-            indexResult = TypeCaster.castTo(IntType(), indexResult)
-        resultName = Temp.getTempName()
-        CodeEmitter.appendLine("Value *%s = builder->CreateInBoundsGEP(%s, %s);" % (resultName, baseResult.value, indexResult.value))
+            indexResult = TypeCaster.castTo(ctx, IntType(), indexResult)
+        resultName = ctx.temp.getTempName()
+        ctx.emitter.appendLine("Value *%s = builder->CreateInBoundsGEP(%s, %s);" % (resultName, baseResult.value, indexResult.value))
         return TranslationResult(baseResult.type, resultName)
-    def translate(self):
-        pointerResult = self.getPointer()
+    def translate(self, ctx):
+        pointerResult = self.getPointer(ctx)
         resultType = pointerResult.type.baseType
-        resultName = Temp.getTempName()
-        CodeEmitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (resultName, pointerResult.value, resultName))
+        resultName = ctx.temp.getTempName()
+        ctx.emitter.appendLine("Value *%s = builder->CreateLoad(%s, \"%s\");" % (resultName, pointerResult.value, resultName))
         return TranslationResult(resultType, resultName)
 
-class Constant(object):
+class Constant(Node):
+    __slots__ = ()
     def __str__(self):
         return self.value
     def __repr__(self):
         return self.__str__()
-    def translate(self):
+    def translate(self, ctx):
         raise UnhandledTranslationError
 
 class IntConstant(Constant):
+    __slots__ = ('value', 'type')
     def __init__(self, value):
         value = value.lower()
         isSigned = True
@@ -1420,33 +1873,58 @@ class IntConstant(Constant):
             isSigned = False
         self.value = value
         self.type = IntType(isSigned, size)
-    def translate(self):
-        name = Temp.getTempName()
-        CodeEmitter.appendLine("Value *%s = getImm%d(%s);" % (name, self.type.size, self.value))
-        return TranslationResult(self.type, name)
+    def translate(self, ctx):
+        return TranslationResult(self.type, ctx.getImm(self.type.size, self.value))
+
+class FoldedConstant(IntConstant):
+    '''an integer expression evaluated by constfold. It is printed as the
+    expression it replaces, and translated as one immediate.'''
+    __slots__ = ('bits', 'original')
+    def __init__(self, type, bits, original):
+        self.type = type
+        self.bits = bits
+        self.original = original
+        self.value = immediateText(bits)
+        span = original.getSpan()
+        if span != None:
+            self.start, self.end, self.line = span
+    def __str__(self):
+        return str(self.original)
+    def translate(self, ctx):
+        ctx.emitComment(self)
+        return IntConstant.translate(self, ctx)
+
+def immediateText(bits):
+    'the C++ literal of an immediate'
+    if bits < 1 << 31:
+        return "%d" % bits
+    return "0x%xull" % bits
 
 class FloatConstant(Constant):
+    __slots__ = ('type', 'value')
     def __init__(self, value):
         self.type = FloatType()
         self.value = value
-    def translate(self):
-        name = Temp.getTempName()
-        CodeEmitter.appendLine("Value *%s = translator::getFp(%s);" % (name, self.value))
-        return TranslationResult(self.type, name)
+    def translate(self, ctx):
+        return TranslationResult(self.type, ctx.getConstant("translator::getFp(%s)" % self.value))
 
 class CharConstant(IntConstant):
+    __slots__ = ()
     def __init__(self, value):
         self.type = IntType(size=8, isSigned=True)
         self.value = value
 
 class StringConstant(Constant):
+    __slots__ = ('type', 'value')
     def __init__(self, value):
         self.type = PointerType(IntType(size=8, isSigned=True))
         self.value = value
 
-class Declarator(object): pass
+class Declarator(Node):
+    __slots__ = ()
 
 class VariableDeclarator(Declarator):
+    __slots__ = ('variable', 'initializer')
     def __init__(self, variable=None, initializer=None):
         self.variable = variable
         self.initializer = initializer
@@ -1459,39 +1937,65 @@ class VariableDeclarator(Declarator):
         if self.initializer != None:
             s += " = " + str(self.initializer)
         return s
-    def translate(self):
-        CodeEmitter.appendLine("/* %s */" % str(self))
-        if isinstance(self.variable.type, TypeIDType):
-            self.variable.type = self.variable.type.getActualType()
-        typeName = self.variable.type.getIRType()
-        allocaName = "ptr_%s_%d" % (self.variable.name, Temp.getTempId())
-        CodeEmitter.appendLine('Value *%s = builder->CreateAlloca(%s, NULL, "%s");' % (allocaName, typeName, allocaName))
-        var = NormalVariable(self.variable.name, self.variable.type, allocaName)
-        variableTable.add(self.variable.name, var)
+    def translate(self, ctx):
+        ctx.emitComment(self)
+        varType = self.variable.type
+        if isinstance(varType, TypeIDType):
+            varType = varType.getActualType(ctx)
+        typeName = varType.getIRType(ctx)
+        if ctx.ssa and isinstance(varType, (IntType, FloatType, DoubleType, PointerType)) and \
+                self.variable.name not in ctx.addressTaken:
+            var = SSAVariable(self.variable.name, varType)
+            ctx.variableTable.add(self.variable.name, var)
+            if self.initializer != None:
+                var.setValue(ctx, self.initializer.translate(ctx))
+            elif varType.getIRTypeHandle(ctx) != None:
+                ctx.ssaValues[var] = ctx.getConstant("UndefValue::get(%s)" % typeName)
+            else:
+                # the type is declared in the body, after the constants
+                undefName = ctx.temp.getTempName()
+                ctx.emitter.appendLine("Value *%s = UndefValue::get(%s);" % (undefName, typeName))
+                ctx.ssaValues[var] = undefName
+            return
+        tempId = ctx.temp.getTempId()
+        allocaName = "ptr_%s_%d" % (self.variable.name, tempId)
+        # at the top of the entry block, where mem2reg looks for the allocas
+        # it promotes, so that allocas in loops do not grow the stack. The
+        # builder is placed again for every alloca: the entry block may be
+        # empty, or already end in a branch, when the snippet starts.
+        entryBuilderName = "entry_builder_%d" % tempId
+        ctx.emitter.appendLine("IRBuilder<> %s(&Translator::getCurFunc()->getEntryBlock(), "
+                               "Translator::getCurFunc()->getEntryBlock().begin());" % entryBuilderName)
+        ctx.emitter.appendLine('Value *%s = %s.CreateAlloca(%s, NULL, "%s");' % (allocaName, entryBuilderName, typeName, allocaName))
+        var = NormalVariable(self.variable.name, varType, allocaName)
+        ctx.variableTable.add(self.variable.name, var)
         if self.initializer != None:
-            result = self.initializer.translate()
-            var.setValue(result)
+            result = self.initializer.translate(ctx)
+            var.setValue(ctx, result)
 
 class TypeDeclarator(Declarator):
+    __slots__ = ('type',)
     def __init__(self, type=None):
         self.type = type
     def __str__(self):
         return str(self.type)
-    def translate(self):
-        CodeEmitter.appendLine("/*\n%s\n*/" % str(self))
+    def translate(self, ctx):
+        ctx.emitComment(self, multiLine=True)
         if isinstance(self.type, StructType) or isinstance(self.type, UnionType):
             if self.type.name != None:
-                typeIDTable.add(self.type.getFullName(), self.type)
+                ctx.typeIDTable.add(self.type.getFullName(), self.type)
         else:
             raise UnhandledTranslationError
 
-class Statement(object):
+class Statement(Node):
+    __slots__ = ()
     def __repr__(self):
         return self.__str__()
-    def translate(self):
+    def translate(self, ctx):
         raise UnhandledTranslationError
 
 class Declaration(Statement):
+    __slots__ = ('declarators',)
     def __init__(self, declarators):
         assert isinstance(declarators, list)
         self.declarators = declarators
@@ -1501,21 +2005,23 @@ class Declaration(Statement):
             s = ",".join([str(declarator) for declarator in self.declarators])
             s += ";"
         return s
-    def translate(self):
+    def translate(self, ctx):
         if self.declarators != None:
             for declarator in self.declarators:
-                declarator.translate()
+                declarator.translate(ctx)
 
 class ExpressionStatement(Statement):
+    __slots__ = ('expression',)
     def __init__(self, expression):
         self.expression = expression
     def __str__(self):
         return str(self.expression) + ";"
-    def translate(self):
-        self.expression.translate()
+    def translate(self, ctx):
+        self.expression.translate(ctx)
         return None
 
 class IfStatement(Statement):
+    __slots__ = ('condition', 'truePart', 'falsePart')
     def __init__(self, condition, truePart=None, falsePart=None):
         self.condition = condition
         self.truePart = truePart
@@ -1535,24 +2041,24 @@ class IfStatement(Statement):
             s += str(self.falsePart)
             s += "\n}"
         return s
-    def translate(self):
-        CodeEmitter.appendLine("/*\n%s\n*/" % str(self))
-        branch = BranchGenerator()
+    def translate(self, ctx):
+        ctx.emitComment(self, multiLine=True)
+        branch = BranchGenerator(ctx)
 
         branch.startCondition()
-        conditionResult = self.condition.translate()
-        conditionResult = TypeCaster.castTo(IntType(False, 1), conditionResult)
+        conditionResult = self.condition.translate(ctx)
+        conditionResult = TypeCaster.castTo(ctx, IntType(False, 1), conditionResult)
         branch.setCondName(conditionResult.value)
         branch.endCondition()
 
         branch.startTruePart()
         if self.truePart != None:
-            self.truePart.translate()
+            self.truePart.translate(ctx)
         branch.endTruePart()
 
         branch.startFalsePart()
         if self.falsePart!= None:
-            self.falsePart.translate()
+            self.falsePart.translate(ctx)
         branch.endFalsePart()
 
         branch.startExitPart()
@@ -1560,6 +2066,7 @@ class IfStatement(Statement):
         return None
 
 class ForStatement(Statement):
+    __slots__ = ('preLoopPart', 'condition', 'postLoopBodyPart', 'loopBodyPart')
     def __init__(self, preLoopPart=None, condition=None, postLoopBodyPart=None, loopBodyPart=None):
         self.preLoopPart = preLoopPart
         self.condition = condition
@@ -1581,181 +2088,247 @@ class ForStatement(Statement):
             s += str(self.loopBodyPart)
         s += "\n}"
         return s
-    def translate(self):
-        variableTable.push()
-        typeIDTable.push()
+    def translate(self, ctx):
+        ctx.variableTable.push()
+        ctx.typeIDTable.push()
 
-        CodeEmitter.appendLine("/*\n%s\n*/" % str(self))
+        ctx.emitComment(self, multiLine=True)
 
         if self.preLoopPart != None:
-            self.preLoopPart.translate()
+            self.preLoopPart.translate(ctx)
 
-        loop = LoopGenerator(LoopType.FOR)
-        loopOrSwitchStack.push(loop)
+        loop = LoopGenerator(ctx, LoopType.FOR, statement=self)
+        ctx.loopOrSwitchStack.push(loop)
         loop.startCondition()
         if self.condition != None:
-            conditionResult = self.condition.translate()
-            conditionResult = TypeCaster.castTo(IntType(False, 1), conditionResult)
+            conditionResult = self.condition.translate(ctx)
+            conditionResult = TypeCaster.castTo(ctx, IntType(False, 1), conditionResult)
             loop.setCondName(conditionResult.value)
         else:
-            one = "one_%d" % Temp.getTempId()
-            CodeEmitter.appendLine("Value *%s = getImm1(1);" % one)
-            loop.setCondName(one)
+            loop.setCondName(ctx.getImm(1, 1))
         loop.endCondition()
 
         loop.startLoopBody()
         if self.loopBodyPart != None:
-            self.loopBodyPart.translate()
+            self.loopBodyPart.translate(ctx)
         loop.endLoopBody()
 
         loop.startPostLoopBodyPart()
         if self.postLoopBodyPart != None:
-            self.postLoopBodyPart.translate()
+            self.postLoopBodyPart.translate(ctx)
         loop.endPostLoopBodyPart()
 
         loop.startExitPart()
         loop.endExitPart()
-        loopOrSwitchStack.pop()
+        ctx.loopOrSwitchStack.pop()
 
-        variableTable.pop()
-        typeIDTable.pop()
+        ctx.variableTable.pop()
+        ctx.typeIDTable.pop()
         return None
 
 class WhileStatement(Statement):
+    __slots__ = ('condition', 'loopBodyPart')
     def __init__(self, condition, loopBodyPart):
         self.condition = condition
         self.loopBodyPart = loopBodyPart
     def __str__(self):
         return "while(%s){\n%s\n};" % (str(self.condition), str(self.loopBodyPart))
-    def translate(self):
-        variableTable.push()
-        typeIDTable.push()
+    def translate(self, ctx):
+        ctx.variableTable.push()
+        ctx.typeIDTable.push()
 
-        CodeEmitter.appendLine("/*\n%s\n*/" % str(self))
-        loop = LoopGenerator(LoopType.WHILE)
-        loopOrSwitchStack.push(loop)
+        ctx.emitComment(self, multiLine=True)
+        loop = LoopGenerator(ctx, LoopType.WHILE, statement=self)
+        ctx.loopOrSwitchStack.push(loop)
 
         assert self.condition != None
         loop.startCondition()
-        conditionResult = self.condition.translate()
-        conditionResult = TypeCaster.castTo(IntType(False, 1), conditionResult)
+        conditionResult = self.condition.translate(ctx)
+        conditionResult = TypeCaster.castTo(ctx, IntType(False, 1), conditionResult)
         loop.setCondName(conditionResult.value)
         loop.endCondition()
 
         loop.startLoopBody()
         if self.loopBodyPart != None:
-            self.loopBodyPart.translate()
+            self.loopBodyPart.translate(ctx)
         loop.endLoopBody()
 
         loop.startExitPart()
         loop.endExitPart()
-        loopOrSwitchStack.pop()
+        ctx.loopOrSwitchStack.pop()
 
-        variableTable.pop()
-        typeIDTable.pop()
+        ctx.variableTable.pop()
+        ctx.typeIDTable.pop()
         return None
 
 class DoWhileStatement(Statement):
+    __slots__ = ('condition', 'loopBodyPart')
     def __init__(self, condition, loopBodyPart):
         self.condition = condition
         self.loopBodyPart = loopBodyPart
     def __str__(self):
         return "do{\n%s\n}while(%s);" % (str(self.loopBodyPart), str(self.condition))
-    def translate(self):
-        variableTable.push()
-        typeIDTable.push()
+    def translate(self, ctx):
+        ctx.variableTable.push()
+        ctx.typeIDTable.push()
 
-        CodeEmitter.appendLine("/*\n%s\n*/" % str(self))
-        loop = LoopGenerator(LoopType.DO_WHILE)
-        loopOrSwitchStack.push(loop)
+        ctx.emitComment(self, multiLine=True)
+        loop = LoopGenerator(ctx, LoopType.DO_WHILE, statement=self)
+        ctx.loopOrSwitchStack.push(loop)
 
         loop.startLoopBody()
         if self.loopBodyPart != None:
-            self.loopBodyPart.translate()
+            self.loopBodyPart.translate(ctx)
         loop.endLoopBody()
 
         assert self.condition != None
         loop.startCondition()
-        conditionResult = self.condition.translate()
-        conditionResult = TypeCaster.castTo(IntType(False, 1), conditionResult)
+        conditionResult = self.condition.translate(ctx)
+        conditionResult = TypeCaster.castTo(ctx, IntType(False, 1), conditionResult)
         loop.setCondName(conditionResult.value)
         loop.endCondition()
 
         loop.startExitPart()
         loop.endExitPart()
-        loopOrSwitchStack.pop()
+        ctx.loopOrSwitchStack.pop()
 
-        variableTable.pop()
-        typeIDTable.pop()
+        ctx.variableTable.pop()
+        ctx.typeIDTable.pop()
         return None
 
 # Note: caseBody is only the first statement of this 'case'
 class CaseStatement(Statement):
+    __slots__ = ('case', 'caseBody')
     def __init__(self, case, caseBody=None):
         self.case = case
         self.caseBody = caseBody
     def __str__(self):
         return "case %s: %s" %(str(self.case), str(self.caseBody))
-    def translate(self):
-        CodeEmitter.appendLine("/* %s */" % str(self))
-        switch = loopOrSwitchStack.getInnermostSwitch()
+    def translate(self, ctx):
+        ctx.emitComment(self)
+        switch = ctx.loopOrSwitchStack.getInnermostSwitch()
         switch.addCase(self.case)
         if self.caseBody != None:
-            self.caseBody.translate()
+            self.caseBody.translate(ctx)
 
 class DefaultStatement(Statement):
+    __slots__ = ('body',)
     def __init__(self, body=None):
         self.body = body
     def __str__(self):
         return "default: %s" % (str(self.body))
-    def translate(self):
-        CodeEmitter.appendLine("/* %s */" % str(self))
-        switch = loopOrSwitchStack.getInnermostSwitch()
+    def translate(self, ctx):
+        ctx.emitComment(self)
+        switch = ctx.loopOrSwitchStack.getInnermostSwitch()
         switch.addDefault()
         if self.body != None:
-            self.body.translate()
+            self.body.translate(ctx)
 
 class BreakStatement(Statement):
+    __slots__ = ()
     def __str__(self):
         return "break;"
-    def translate(self):
-        CodeEmitter.appendLine("/* break */")
-        loopOrSwitch = loopOrSwitchStack.top()
+    def translate(self, ctx):
+        ctx.emitComment(self, text="break")
+        loopOrSwitch = ctx.loopOrSwitchStack.top()
         loopOrSwitch.startBreak()
         loopOrSwitch.endBreak()
 
 class ContinueStatement(Statement):
+    __slots__ = ()
     def __str__(self):
         return "continue;"
-    def translate(self):
-        CodeEmitter.appendLine("/* continue */")
-        loop = loopOrSwitchStack.getInnermostLoop()
+    def translate(self, ctx):
+        ctx.emitComment(self, text="continue")
+        loop = ctx.loopOrSwitchStack.getInnermostLoop()
         loop.startContinue()
         loop.endContinue()
 
 class SwitchStatement(Statement):
+    __slots__ = ('control', 'bodyPart')
     def __init__(self, control, bodyPart):
         self.control = control
         self.bodyPart = bodyPart
     def __str__(self):
         return "switch(%s) {\n%s\n}" % (str(self.control), str(self.bodyPart))
-    def translate(self):
+    def translate(self, ctx):
         assert self.control != None
-        CodeEmitter.appendLine("/* %s */" % (str(self)))
-        variableTable.push()
-        typeIDTable.push()
-        controlResult = self.control.translate()
-        switch = SwitchGenerator(controlResult)
-        loopOrSwitchStack.push(switch)
+        ctx.emitComment(self)
+        ctx.variableTable.push()
+        ctx.typeIDTable.push()
+        controlResult = self.control.translate(ctx)
+        table = lookuptable.findTable(self)
+        if table != None and self.translateTable(ctx, table, controlResult):
+            ctx.variableTable.pop()
+            ctx.typeIDTable.pop()
+            return
+        switch = SwitchGenerator(ctx, controlResult)
+        ctx.loopOrSwitchStack.push(switch)
         switch.startSwtich()
         if self.bodyPart != None:
-            self.bodyPart.translate()
+            self.bodyPart.translate(ctx)
         switch.endSwitch()
-        loopOrSwitchStack.pop()
-        variableTable.pop()
-        typeIDTable.pop()
+        ctx.loopOrSwitchStack.pop()
+        ctx.variableTable.pop()
+        ctx.typeIDTable.pop()
+    def translateTable(self, ctx, table, controlResult):
+        '''lower a switch that only picks constants (see lookuptable.py) to
+        table loads and a single assignment or call. False if the tables do
+        not fit, and nothing is emitted then.'''
+        controlType = controlResult.type
+        if not isinstance(controlType, IntType):
+            return False
+        if table.kind == "assign":
+            target = ctx.variableTable.get(table.target)
+            if target == None:
+                return False
+            operandTypes = [target.type]
+        else:
+            operandTypes = list(functions[table.target][1:])
+        if len(operandTypes) != len(table.groups[0][1]) or \
+                [t for t in operandTypes if not isinstance(t, IntType)]:
+            return False
+        tableLayout = lookuptable.layout(table, controlType, lookuptable.controlLimit(self.control, controlType))
+        if tableLayout == None:
+            return False
+        first, count, rows, covering = tableLayout
+        size = controlType.size
+        if table.kind == "call" and table.default == None and not covering:
+            # without a default, the function is not called out of range
+            return False
+        index = controlResult.value
+        if first != 0:
+            index = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateSub(%s, %s);" %
+                (index, controlResult.value, ctx.getImm(size, immediateText(first))))
+        inRange = None
+        if not covering:
+            # the value out of range loads the default row, or the first one
+            inRange = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateICmpULT(%s, %s);" %
+                (inRange, index, ctx.getImm(size, count)))
+            clamped = ctx.temp.getTempName()
+            ctx.emitter.appendLine("Value *%s = builder->CreateSelect(%s, %s, %s);" %
+                (clamped, inRange, index, ctx.getImm(size, len(rows) - 1 if len(rows) > count else 0)))
+            index = clamped
+        # GEP indices are signed
+        index = TypeCaster.castTo(ctx, IntType(False, 64), TranslationResult(IntType(False, size), index)).value
+        operands = []
+        for i, operandType in enumerate(operandTypes):
+            entries = [constfold.castBits(row[i][1], row[i][0], operandType) for row in rows]
+            operands.append(LookupTableExpression(index, entries, operandType))
+        if table.kind == "assign":
+            if table.default == None and inRange != None:
+                # no default: out of range, the variable keeps its value
+                operands[0].inRange = inRange
+                operands[0].fallback = Variable(table.target)
+            BinaryOperandExpression(Variable(table.target), "=", operands[0]).translate(ctx)
+        else:
+            FunctionCallExpression(Variable(table.target), operands).translate(ctx)
+        return True
 
 class CompoundStatement(Statement):
+    __slots__ = ('statements',)
     def __init__(self, statements=None):
         self.statements = statements
     def __str__(self):
@@ -1767,15 +2340,25 @@ class CompoundStatement(Statement):
                 s += "\n"
         s += "\n}"
         return s
-    def translate(self):
+    def translate(self, ctx):
         if self.statements != None:
             assert isinstance(self.statements, list)
-            variableTable.push()
-            typeIDTable.push()
-            for item in self.statements:
-                item.translate()
-            variableTable.pop()
-            typeIDTable.pop()
+            ctx.variableTable.push()
+            ctx.typeIDTable.push()
+            flagsEnd = 0
+            for i, item in enumerate(self.statements):
+                if not isinstance(item, (CaseStatement, DefaultStatement)):
+                    ctx.reopenBlock()
+                if i >= flagsEnd:
+                    # consecutive statements setting flags share their operands
+                    flagsEnd = i + flagRunLength(self.statements, i)
+                    ctx.flags = None
+                    if flagsEnd > i + 1:
+                        ctx.flags = FlagComputation()
+                item.translate(ctx)
+            ctx.flags = None
+            ctx.variableTable.pop()
+            ctx.typeIDTable.pop()
         return None
 
 predefinedTypeID = {
@@ -1823,17 +2406,6 @@ class DictStack(list):
         else:
             return False
 
-typeIDTable = DictStack()
-typeIDTable.push(predefinedTypeID)
-
-# This table is only used to identify TYPEID during lexing and parsing.
-tempTypeIDTable = DictStack()
-tempTypeIDTable.push(predefinedTypeID)
-tempTypeIDTable.push()
-
-variableTable = DictStack()
-variableTable.push(predefinedValues)
-
 # The stack will save the loops or swtiches being translated.
 # This stack is used while translating 'continue', 'break' and 'case'
 class LoopOrSwitchStack(list):
@@ -1843,43 +2415,197 @@ class LoopOrSwitchStack(list):
     def top(self):
         return self[-1]
     def getInnermostLoop(self):
-        for i in range(len(loopOrSwitchStack)-1, -1, -1):
-            loop = loopOrSwitchStack[i]
+        for i in range(len(self)-1, -1, -1):
+            loop = self[i]
             if isinstance(loop, LoopGenerator):
                 return loop
         else:
             raise UnhandledTranslationError
     def getInnermostSwitch(self):
-        for i in range(len(loopOrSwitchStack)-1, -1, -1):
-            switch = loopOrSwitchStack[i]
+        for i in range(len(self)-1, -1, -1):
+            switch = self[i]
             if isinstance(switch, SwitchGenerator):
                 return switch
         else:
             raise UnhandledTranslationError
 
-loopOrSwitchStack = LoopOrSwitchStack() 
+# How the generated code is commented with the source it comes from
+class CommentMode(object):
+    FULL = "full"   # every translated node, printed back from the tree
+    LINES = "lines" # every source line once, before the code of its first node
+    NONE = "none"
+    modes = (FULL, LINES, NONE)
+
+# Everything a single translation writes to: the emitted code, the temp
+# counter and the symbol tables. Two contexts share nothing, so snippets
+# can be translated one after another (or side by side) without leaking
+# state into each other.
+class TranslationContext(object):
+    '''With ssa, scalar locals are kept in SSA form (see PhiJoin) instead
+    of allocas, so the generated code has no loads and stores for them.'''
+    def __init__(self, sink=None, commentMode=CommentMode.FULL, ssa=False):
+        assert commentMode in CommentMode.modes
+        self.sink = sink
+        self.commentMode = commentMode
+        self.ssa = ssa
+        self.reset()
+    def reset(self):
+        self.emitter = CodeEmitter(self.sink)
+        self.temp = Temp()
+        self.setSource(None)
+
+        self.typeIDTable = DictStack()
+        self.typeIDTable.push(predefinedTypeID)
+
+        # This table is only used to identify TYPEID during lexing and parsing.
+        self.typeNames = clex.TypeNameTable(predefinedTypeID.keys())
+
+        self.variableTable = DictStack()
+        self.variableTable.push(predefinedValues)
+
+        self.loopOrSwitchStack = LoopOrSwitchStack()
+
+        # IR name of every struct or union type created so far
+        self.structIRTypeNames = {}
+        # IR type handles declared in the prologue
+        self.irTypeHandles = set()
+        # handle of every constant declared in the prologue, by the expression making it
+        self.constants = {}
+        # current value of every SSAVariable, and the names that must stay in memory
+        self.ssaValues = {}
+        self.addressTaken = set()
+        # whether the block code is emitted to already ends in a jump, and
+        # the number of blocks created
+        self.terminated = False
+        self.blockCount = 0
+        # the FlagComputation of the run of statements setting flags being translated
+        self.flags = None
+    def translate(self, tree):
+        'fold the constants of a parsed snippet and translate it'
+        constfold.fold(self, tree)
+        if self.ssa:
+            self.addressTaken = addressTakenNames(tree)
+        tree.translate(self)
+    def createBlock(self, blockName):
+        'create a basic block of the current function, named blockName'
+        self.blockCount += 1
+        self.emitter.appendLine('BasicBlock *%s = BasicBlock::Create(context, "%s", Translator::getCurFunc());' %
+            (blockName, blockName))
+    def enterBlock(self, blockName):
+        'emit the code that follows into blockName'
+        self.emitter.appendLine("builder->SetInsertPoint(%s);" % blockName)
+        self.terminated = False
+    def emitBranch(self, blockName, join=None):
+        '''jump to blockName, recording the edge with join, unless the block
+        already ends in a jump ('break', 'continue', ...)'''
+        if self.terminated:
+            return
+        if join != None:
+            join.addEdge()
+        self.emitter.appendLine("builder->CreateBr(%s);" % blockName)
+        self.terminated = True
+    def emitCondBranch(self, condName, trueBlockName, falseBlockName):
+        self.emitter.appendLine("builder->CreateCondBr(%s, %s, %s);" % (condName, trueBlockName, falseBlockName))
+        self.terminated = True
+    def reopenBlock(self):
+        '''give the code that follows a jump a block of its own. No block
+        branches to it, and LLVM deletes it.'''
+        if self.terminated:
+            blockName = "never_been_reached_%d" % self.temp.getTempId()
+            self.createBlock(blockName)
+            self.enterBlock(blockName)
+    def getCurrentBlock(self):
+        'name a handle of the block code is emitted to'
+        blockName = "block_%d" % self.temp.getTempId()
+        self.emitter.appendLine("BasicBlock *%s = builder->GetInsertBlock();" % blockName)
+        return blockName
+    def declareIRType(self, typeName, declaration):
+        '''declare the IR type handle typeName in the prologue, once per
+        translation, and return typeName'''
+        if typeName not in self.irTypeHandles:
+            self.irTypeHandles.add(typeName)
+            self.emitter.declare(declaration)
+        return typeName
+    def getConstant(self, expression):
+        '''the handle of the constant the C++ expression (getImm32(1), ...)
+        makes, declared once in the prologue. Constants are not
+        instructions, so the handle can be used anywhere in the function.'''
+        name = self.constants.get(expression)
+        if name == None:
+            name = "const_%d" % len(self.constants)
+            self.constants[expression] = name
+            self.emitter.declare("Value *%s = %s;" % (name, expression))
+        return name
+    def getImm(self, size, value):
+        'the handle of the integer constant value of the given width'
+        return self.getConstant("getImm%d(%s)" % (size, value))
+    def setSource(self, source):
+        'the snippet being translated, for CommentMode.LINES'
+        self.source = source
+        self.sourceLines = None
+        self.commentedLines = 0
+    def emitComment(self, node, multiLine=False, text=None):
+        '''comment the code about to be emitted for node. In CommentMode.FULL
+        the comment is text, or else the node printed back.'''
+        if self.commentMode == CommentMode.FULL:
+            if text == None:
+                text = str(node)
+            if multiLine:
+                self.emitter.appendLine("/*\n%s\n*/" % text)
+            else:
+                self.emitter.appendLine("/* %s */" % text)
+        elif self.commentMode == CommentMode.LINES:
+            span = node.getSpan()
+            if span == None or self.source == None:
+                return
+            if self.sourceLines == None:
+                self.sourceLines = self.source.split("\n")
+            while self.commentedLines < span[2]:
+                self.commentedLines += 1
+                line = self.sourceLines[self.commentedLines - 1].strip()
+                if line != "":
+                    self.emitter.appendLine("/* %d: %s */" % (self.commentedLines, line.replace("*/", "* /")))
 
 debug = False
 
 class Translator(object):
+    cache = None
+    astCache = None
+    commentMode = CommentMode.FULL
+    ssa = False
+    @classmethod
+    def enableCache(cls, directory, maxBytes=64*1024*1024):
+        'reuse translations from an on-disk cache (see cache.py)'
+        import cache
+        cls.cache = cache.ContentCache(directory, maxBytes)
+    @classmethod
+    def enableASTCache(cls, directory, maxBytes=256*1024*1024):
+        'reuse parsed trees from an on-disk cache (see cache.py)'
+        import cache
+        cls.astCache = cache.ASTCache(directory, maxBytes)
     @classmethod
     def translate(cls, instruction, source):
-        tempTypeIDTable = DictStack()
-        tempTypeIDTable.push(predefinedTypeID)
-        tempTypeIDTable.push()
-
-        CodeEmitter.init()
-        source = preprocess(source)
         if debug:
             print instruction
         print instruction
-        parseResult = cparse.parser.parse(source, debug=debug, lexer=clex.lexer)
-        parseResult.translate()
-        return CodeEmitter.getCode()
+        if cls.cache != None:
+            key = cls.cache.key(source, "%s %s" % (cls.commentMode, cls.ssa))
+            code = cls.cache.get(key)
+            if code != None:
+                return code
+        ctx = TranslationContext(commentMode=cls.commentMode, ssa=cls.ssa)
+        parseResult = cparse.parse(ctx, source, debug=debug, astCache=cls.astCache)
+        ctx.translate(parseResult)
+        code = ctx.emitter.getCode()
+        if cls.cache != None:
+            cls.cache.put(key, code)
+        return code
     @classmethod
     def addBitfield(cls, bitfield):
         global predefinedValues
         predefinedValues[bitfield] = IntConstantVariable(bitfield, IntType(True, 64))
+        if cls.cache != None:
+            cls.cache.refreshSchema()
     @classmethod
     def addOperand(cls, operandName, operandCType):
         global predefinedValues
@@ -1893,3 +2619,5 @@ class Translator(object):
         else:
             raise UnhandledTranslationError
         predefinedValues[operandName] = Operand(operandName, operandType)
+        if cls.cache != None:
+            cls.cache.refreshSchema()